@@ -0,0 +1,76 @@
+"""Measures how much update graph time the bikeshare pipeline spends on each trip in streaming mode.
+
+Trips are replayed from the snapshot at --speed, and every --interval seconds the update graph time spent since
+the last sample is read from the update performance log, per second and per thousand trips that arrived. A
+pipeline keeps up with the feed while its update time stays well under 1000 ms per second; raise --speed to find
+where it stops doing so. Run from the repository root:
+
+    python benchmarks/bikeshare_streaming.py --data-dir data/static --speed 86400
+"""
+
+import argparse
+import sys
+import time
+
+from deephaven_server import Server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", default="data/static")
+    parser.add_argument("--speed", type=float, default=86400.0, help="seconds of trips replayed per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to run for")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between samples")
+    parser.add_argument("--port", type=int, default=10002)
+    args = parser.parse_args()
+
+    s = Server(port=args.port, jvm_args=["-Xmx4g",
+                                         "-DAuthHandlers=io.deephaven.auth.AnonymousAuthenticationHandler",
+                                         "-Dprocess.info.system-info.enabled=false",
+                                         "-DUpdatePerformanceTracker.reportIntervalMillis=1000"])
+    s.start()
+
+    from deephaven import perfmon
+    from deephaven.update_graph import shared_lock
+    import deephaven.agg as agg
+    import deephaven.numpy as dhnp
+    import deephaven.time as dhtu
+
+    sys.path.append(".")
+    from shared.bikeshare import create_tables
+
+    usage = perfmon.update_performance_log()
+
+    tables = create_tables(args.data_dir, args.speed)
+    trips = tables["trips"]
+
+    def update_nanos(since, until) -> int:
+        # the log has a row per operation per second of update graph work, summed over every operation
+        window = usage.where(["IntervalStartTime >= since", "IntervalStartTime < until"]).agg_by(agg.sum_("UsageNanos"))
+        with shared_lock(window):
+            return int(dhnp.to_numpy(window)[0][0]) if window.size > 0 else 0
+
+    print(f"{'elapsed_s':>10} {'trips':>10} {'trips_per_s':>12} {'update_ms_per_s':>16} {'update_ms_per_1k_trips':>23}")
+    start = last_time = time.monotonic()
+    last_instant = dhtu.dh_now()
+    first_rows = last_rows = trips.size
+    total_nanos = 0
+    while time.monotonic() - start < args.duration:
+        time.sleep(args.interval)
+        now, instant, rows = time.monotonic(), dhtu.dh_now(), trips.size
+        # let the performance log catch up with the interval that was running at the sample
+        time.sleep(2)
+        nanos = update_nanos(last_instant, instant)
+        total_nanos += nanos
+        arrived, elapsed = rows - last_rows, now - last_time
+        print(f"{now - start:>10.1f} {rows:>10} {arrived / elapsed:>12.0f} {nanos / 1e6 / elapsed:>16.2f} "
+              f"{nanos / 1e6 / max(arrived / 1000, 1e-9):>23.2f}")
+        last_time, last_instant, last_rows = now, instant, rows
+
+    arrived = last_rows - first_rows
+    print(f"overall: {arrived} trips, {total_nanos / 1e6 / (last_time - start):.2f} update ms/s, "
+          f"{total_nanos / 1e6 / max(arrived / 1000, 1e-9):.2f} update ms per 1k trips")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Compares rolling_time_window with the relative_time_window it replaced in the Dash crypto backend.
+
+Both build the OHLC of every instrument over the current and previous --period seconds, first over the
+250k-row crypto dataset as a static table, then while the afternoon trades are replayed onto the morning ones
+at --speed. The replay run reports the update graph time spent on each version, read from the update
+performance log, per second and per thousand appended rows. Run from the repository root:
+
+    python benchmarks/crypto_time_window.py --period 30 --speed 10
+"""
+
+import argparse
+import sys
+import time
+from datetime import timedelta
+from typing import Optional
+
+from deephaven_server import Server
+
+CRYPTO_CSV = "https://media.githubusercontent.com/media/deephaven/examples/main/CryptoCurrencyHistory/CSV/CryptoTrades_20210922.csv"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--period", type=int, default=30, help="window length in seconds")
+    parser.add_argument("--speed", type=float, default=10.0, help="seconds of trades replayed per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to replay for, per version")
+    parser.add_argument("--port", type=int, default=10003)
+    args = parser.parse_args()
+
+    s = Server(port=args.port, jvm_args=["-Xmx4g",
+                                         "-DAuthHandlers=io.deephaven.auth.AnonymousAuthenticationHandler",
+                                         "-Dprocess.info.system-info.enabled=false",
+                                         "-DUpdatePerformanceTracker.reportIntervalMillis=1000"])
+    s.start()
+
+    from deephaven import merge, perfmon, read_csv
+    from deephaven.liveness_scope import liveness_scope
+    from deephaven.replay import TableReplayer
+    from deephaven.table import Table
+    from deephaven.update_graph import shared_lock
+    import deephaven.agg as agg
+    import deephaven.numpy as dhnp
+    import deephaven.time as dhtu
+
+    sys.path.append(".")
+    from shared.time_window import rolling_time_windows
+
+    # the previous implementation, kept here as the baseline
+    def relative_time_window(
+            table: Table,
+            ts_col: str,
+            window: timedelta,
+            offset: timedelta = timedelta(seconds=0),
+            snap: Optional[timedelta] = None) -> Table:
+
+        j_window = dhtu.to_j_duration(window)
+        j_offset = dhtu.to_j_duration(offset)
+        current_time = table.agg_by(agg.sorted_last(ts_col, ts_col))
+        table = table.natural_join(current_time, on=None, joins=f"CurrentTime={ts_col}")
+
+        if snap is not None:
+            j_snap = dhtu.to_j_duration(snap)
+            return table.\
+                update(f"SnappedTime = lowerBin({ts_col}, j_snap.toNanos())").\
+                where(f"CurrentTime - SnappedTime < j_snap.toNanos() + j_offset.toNanos() + j_window.toNanos() && \
+                        CurrentTime - SnappedTime > j_snap.toNanos() + j_offset.toNanos()").\
+                drop_columns(["CurrentTime", "SnappedTime"])
+
+        return table.\
+            where(f"CurrentTime - {ts_col} < j_offset.toNanos() + j_window.toNanos() && \
+                    CurrentTime - {ts_col} > j_offset.toNanos()").\
+            drop_columns("CurrentTime")
+
+    def baseline_ohlc(table: Table, window: timedelta) -> Table:
+        snap = timedelta(seconds=5)
+        current = relative_time_window(table, "Timestamp", window, snap=snap).\
+            agg_by([agg.first("CurrentOpen=Price"), agg.max_("CurrentHigh=Price"),
+                    agg.min_("CurrentLow=Price"), agg.last("CurrentClose=Price")], by="Instrument")
+        previous = relative_time_window(table, "Timestamp", window, offset=window, snap=snap).\
+            agg_by([agg.first("PreviousOpen=Price"), agg.max_("PreviousHigh=Price"),
+                    agg.min_("PreviousLow=Price"), agg.last("PreviousClose=Price")], by="Instrument")
+        return current.natural_join(previous, on="Instrument")
+
+    def rolling_ohlc(table: Table, window: timedelta) -> Table:
+        snap = timedelta(seconds=5)
+        windows = {"Current": (window, timedelta(seconds=0)), "Previous": (window, window)}
+        return rolling_time_windows(table, "Timestamp", "Price", windows, snap=snap, by="Instrument").last_by("Instrument")
+
+    versions = {"relative_time_window": baseline_ohlc, "rolling_time_window": rolling_ohlc}
+    window = timedelta(seconds=args.period)
+
+    trades = read_csv(CRYPTO_CSV, num_rows=250000).view(["Instrument", "Timestamp", "Price"]).sort("Timestamp")
+    morning = trades.where("minuteOfDay(Timestamp, 'ET') < 60*12 + 30")
+    afternoon = trades.where("minuteOfDay(Timestamp, 'ET') >= 60*12 + 30")
+    bounds = dhnp.to_numpy(afternoon.agg_by([agg.min_("first = Timestamp"), agg.max_("last = Timestamp")]))[0]
+    first_time = dhtu.to_j_instant(bounds[0])
+    replay_end = dhtu.to_j_instant(bounds[0] + (bounds[1] - bounds[0]) / args.speed)
+    afternoon = afternoon.update(f"ReplayTime = plus(first_time, (long)(minus(Timestamp, first_time) / {args.speed}))")
+
+    usage = perfmon.update_performance_log()
+
+    print(f"{trades.size} trades, {args.period}s windows")
+    print(f"{'version':<22} {'static_build_s':>14} {'replayed_rows':>14} {'update_ms_per_s':>16} {'update_ms_per_1k_rows':>22}")
+    for name, build in versions.items():
+        # each version is released before the next one runs, so its listeners do not show up in the next run
+        scope = liveness_scope()
+        with scope.open():
+            start = time.monotonic()
+            build(trades, window)
+            static_build = time.monotonic() - start
+
+            replayer = TableReplayer(first_time, replay_end)
+            replayed = replayer.add_table(afternoon, "ReplayTime").drop_columns("ReplayTime")
+            build(merge([morning, replayed]), window)
+            run_start = dhtu.dh_now()
+            replayer.start()
+            time.sleep(args.duration)
+            replayer.shutdown()
+            # let the performance log catch up with the last intervals
+            time.sleep(3)
+
+            with shared_lock(usage):
+                rows = replayed.size
+                nanos = dhnp.to_numpy(usage.where("IntervalStartTime >= run_start").agg_by(agg.sum_("UsageNanos")))[0][0]
+        scope.release()
+
+        print(f"{name:<22} {static_build:>14.2f} {rows:>14} {nanos / 1e6 / args.duration:>16.2f} "
+              f"{nanos / 1e6 / max(rows / 1000, 1e-9):>22.2f}")
+
+
+if __name__ == "__main__":
+    main()
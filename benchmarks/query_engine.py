@@ -0,0 +1,123 @@
+"""Checks what the query engine behind the dashboards' query boxes accepts, refuses and estimates.
+
+Queries that call Java outside the columns of the tables must be refused before anything runs, as must
+operations that are not whitelisted. Queries differing only in formatting must share one cached table, and the
+cost estimates must rank queries by the work they do and refuse those over the budget. Each check prints a
+line, and the script exits with an error if any of them fails. Run from the repository root:
+
+    python benchmarks/query_engine.py
+"""
+
+import argparse
+import sys
+import time
+
+from deephaven_server import Server
+
+# queries that must be refused, each for reaching outside the columns or the whitelisted operations
+REFUSED = [
+    "trips.update('x = Runtime.getRuntime().exec(`ls`)')",
+    "trips.update('x = java.lang.System.exit(0)')",
+    "trips.update('x = new java.io.File(`a`).delete()')",
+    "trips.update('x = start_time.getClass().forName(`java.lang.Runtime`)')",
+    "trips.update('x = java/**/.nio.file.Files.size(null)')",
+    "trips.update('x = java\\\\u002enio.file.Files.size(null)')",
+    "trips.update('x = `a\" + java.lang.Thread.sleep(1) + \"`')",
+    "trips.update('x = Thread.sleep(100000)')",
+    "__import__('os').system('ls')",
+    "trips.where('true').to_pandas()",
+    "trips.agg_by([agg.__class__()], by='bikeid')",
+    "open('/etc/passwd')",
+    "'a'.join([trips])",
+    "[trips].sort('bikeid')",
+    "stations",
+]
+
+# queries that must be accepted
+ACCEPTED = [
+    "trips",
+    "trips.update(\"month = monthOfYear(start_time, 'CT')\").where(\"month == 3\")",
+    "trips.where('subscriber_type.contains(`Annual`)')",
+    "trips.where('subscriber_type == `a.b(c)`').count_by('n', by='subscriber_type')",
+    "trips.agg_by([agg.median('m = duration_minutes')], by=['subscriber_type'])",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000, help="rows in the generated trips table")
+    parser.add_argument("--port", type=int, default=10004)
+    args = parser.parse_args()
+
+    s = Server(port=args.port, jvm_args=["-Xmx4g",
+                                         "-DAuthHandlers=io.deephaven.auth.AnonymousAuthenticationHandler",
+                                         "-Dprocess.info.system-info.enabled=false"])
+    s.start()
+
+    from deephaven import empty_table
+
+    sys.path.append(".")
+    from shared.query import QueryBudget, QueryBudgetError, QueryEngine, QueryError, compile_query
+    from shared.table_cache import TableCache
+
+    trips = empty_table(args.rows).update([
+        "trip_id = (long)i",
+        "bikeid = (int)(i % 500)",
+        "subscriber_type = i % 3 == 0 ? `Annual Membership` : `Walk Up`",
+        "duration_minutes = (int)(i % 120)",
+        "start_time = '2016-01-01T00:00:00 ET' + i * MINUTE"])
+
+    start = time.monotonic()
+    engine = QueryEngine({"trips": trips}, cache=TableCache(), budget=QueryBudget(max_cost=20 * args.rows))
+    print(f"counted the cardinalities of {args.rows} rows in {time.monotonic() - start:.2f}s")
+
+    failures = []
+
+    def check(ok: bool, description: str) -> None:
+        print(f"{'ok  ' if ok else 'FAIL'} {description}")
+        if not ok:
+            failures.append(description)
+
+    for query in REFUSED:
+        try:
+            engine.compile(query)
+            check(False, f"refused {query}")
+        except QueryError as e:
+            check(True, f"refused {query}: {e}")
+
+    for query in ACCEPTED:
+        try:
+            engine.compile(query)
+            check(True, f"accepted {query}")
+        except QueryError as e:
+            check(False, f"accepted {query}: {e}")
+
+    check(compile_query("trips.where( 'bikeid  ==  3' )") == compile_query("trips.where('bikeid == 3')"),
+          "formatting does not change the compiled query")
+    first = engine.run("trips.where( 'bikeid  ==  3' )")
+    second = engine.run("trips.where('bikeid == 3')")
+    check(first is second, "differently formatted queries share one table")
+    engine.release(first)
+    engine.release(second)
+
+    few_rows, few_cost = engine.estimate("trips.count_by('n', by='subscriber_type')")
+    many_rows, many_cost = engine.estimate("trips.count_by('n', by=['bikeid', 'subscriber_type'])")
+    check(few_rows == 2, f"count_by on subscriber_type is estimated at 2 groups, got {few_rows:g}")
+    check(few_rows < many_rows <= args.rows, f"more keys give more groups, {few_rows:g} < {many_rows:g}")
+    _, sorted_cost = engine.estimate("trips.sort('duration_minutes')")
+    _, head_cost = engine.estimate("trips.head(10)")
+    check(head_cost < few_cost < sorted_cost, f"head < count_by < sort, {head_cost:g} < {few_cost:g} < {sorted_cost:g}")
+
+    try:
+        engine.run("trips.join(trips, on='bikeid')")
+        check(False, "a self join on bikeid is refused by the budget")
+    except QueryBudgetError as e:
+        check(True, f"a self join on bikeid is refused by the budget: {e}")
+
+    if failures:
+        sys.exit(f"{len(failures)} checks failed")
+    print("all checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+// follows the trades of the selected instrument pushed by /stream/trades, and extends the price chart with them
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    trade_stream: {
+        follow: function (figure, instrument) {
+            if (window.tradeStream) {
+                window.tradeStream.close();
+            }
+
+            // events arriving before plotly has drawn the figure wait here
+            const pending = [];
+            const graph = () => document.querySelector('#graph-content .js-plotly-plot');
+            const apply = () => {
+                const gd = graph();
+                if (!gd || !gd.data) {
+                    setTimeout(apply, 50);
+                    return;
+                }
+                while (pending.length > 0) {
+                    const [type, rows] = pending.shift();
+                    if (type === 'reset') {
+                        Plotly.restyle(gd, {x: [rows.Timestamp], y: [rows.Price]}, [0]);
+                    } else {
+                        Plotly.extendTraces(gd, {x: [rows.Timestamp], y: [rows.Price]}, [0]);
+                    }
+                }
+            };
+
+            const source = new EventSource('/stream/trades?instrument=' + encodeURIComponent(instrument));
+            for (const type of ['reset', 'append']) {
+                source.addEventListener(type, (event) => {
+                    pending.push([type, JSON.parse(event.data)]);
+                    if (pending.length === 1) {
+                        apply();
+                    }
+                });
+            }
+            window.tradeStream = source;
+            return instrument;
+        }
+    }
+});
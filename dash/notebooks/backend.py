@@ -11,10 +11,18 @@ CTX = get_exec_ctx()
 #### IMPORTS ####
 
 # data imports
-from deephaven import read_csv
+from deephaven import read_csv, merge
 from deephaven.replay import TableReplayer
 
 # analysis imports
+import sys
+from deephaven.table import Table
+
+from datetime import timedelta
+
+# make the shared packages importable
+sys.path.append("../..")
+from shared.time_window import rolling_time_windows
 
 # plotting imports
 
@@ -31,8 +39,49 @@ historical = data.where("minuteOfDay(Timestamp, 'ET') < 60*12 + 30")
 historical2 = data.where("minuteOfDay(Timestamp, 'ET') >= 60*12 + 30")
 
 replayer = TableReplayer("2021-09-22T12:30:00.000 ET", "2021-09-22T13:01:48.054 ET")
-streaming = replayer.add_table(historical2.sort("Timestamp"), "Timestamp").sort_descending("Timestamp")
+# trades in arrival order, which only ever grows at the end, for the dashboard to push to the browser
+replayed = replayer.add_table(historical2.sort("Timestamp"), "Timestamp")
+streaming = replayed.sort_descending("Timestamp")
 replayer.start()
 
+# merged from the replayed trades in arrival order rather than the descending view, so ties stay in time order
+data = merge([historical, replayed])
+
+#### OHLC ####
+
+# periods offered by the dashboard, in seconds
+PERIODS = [5, 15, 30, 60, 300, 900, 1800]
+
+def ohlc_windows(periods: list) -> dict:
+    windows = {}
+    for period in periods:
+        window = timedelta(seconds=period)
+        windows[f"P{period}Current"] = (window, timedelta(seconds=0))
+        windows[f"P{period}Previous"] = (window, window)
+    return windows
+
+# the current and previous OHLC of every period are maintained by one sorted update_by, so a period costs
+# its own rolling operators and as-of joins rather than another pass over the trades
+ohlc_by_period = rolling_time_windows(data.view(["Instrument", "Timestamp", "Price"]), "Timestamp", "Price",
+                                      ohlc_windows(PERIODS), snap=timedelta(seconds=5), by="Instrument").\
+    last_by("Instrument")
+
+def ohlc_table(table: Table, period: int) -> Table:
+    current, previous = f"P{period}Current", f"P{period}Previous"
+    return table.\
+        view(["Instrument",
+              f"Period = {period}",
+              f"CurrentOpen = {current}Open",
+              f"CurrentHigh = {current}High",
+              f"CurrentLow = {current}Low",
+              f"CurrentClose = {current}Close",
+              f"OpenDelta = 100 * ({current}Open - {previous}Open) / {previous}Open",
+              f"HighDelta = 100 * ({current}High - {previous}High) / {previous}High",
+              f"LowDelta = 100 * ({current}Low - {previous}Low) / {previous}Low",
+              f"CloseDelta = 100 * ({current}Close - {previous}Close) / {previous}Close"])
+
+# one row per instrument and period, looked up by the dashboard
+ohlc = merge([ohlc_table(ohlc_by_period, period) for period in PERIODS]).partition_by(["Instrument", "Period"])
+
 def get_tables():
-    return CTX, historical, streaming
\ No newline at end of file
+    return CTX, historical, streaming, replayed, data, ohlc
\ No newline at end of file
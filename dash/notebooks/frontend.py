@@ -10,52 +10,47 @@ import dash_bootstrap_components as dbc
 import pandas as pd
 
 # dh imports
-import deephaven.pandas as dhpd
-import deephaven.time as dhtu
-import deephaven.agg as agg
-from deephaven import merge
+from deephaven.update_graph import shared_lock
+
+# push imports
+import sys
+import flask
+
+sys.path.append("../..")
+from shared.export import to_pandas
+from shared.push import RowBroadcaster, server_sent_events, snapshot_rows
+from shared.table_cache import TABLE_CACHE
 
 # plotting imports
 import plotly.express as px
 
-### custom function for time-based ring table
-from datetime import timedelta
-from deephaven.table import Table
-from typing import Optional
-
-def relative_time_window(
-        table: Table,
-        ts_col: str,
-        window: timedelta,
-        offset: timedelta = timedelta(seconds=0),
-        snap: Optional[timedelta] = None) -> Table:
-
-    j_window = dhtu.to_j_duration(window)
-    j_offset = dhtu.to_j_duration(offset)
-    current_time = table.agg_by(agg.sorted_last(ts_col, ts_col))
-    table = table.natural_join(current_time, on=None, joins=f"CurrentTime={ts_col}")
-
-    if snap is not None:
-        j_snap = dhtu.to_j_duration(snap)
-        return table.\
-            update(f"SnappedTime = lowerBin({ts_col}, j_snap.toNanos())").\
-            where(f"CurrentTime - SnappedTime < j_snap.toNanos() + j_offset.toNanos() + j_window.toNanos() && \
-                    CurrentTime - SnappedTime > j_snap.toNanos() + j_offset.toNanos()").\
-            drop_columns(["CurrentTime", "SnappedTime"])
-
-    return table.\
-        where(f"CurrentTime - {ts_col} < j_offset.toNanos() + j_window.toNanos() && \
-                CurrentTime - {ts_col} > j_offset.toNanos()").\
-        drop_columns("CurrentTime")
-
-CTX, historical, streaming = backend.get_tables()
-data = merge([historical, streaming])
-
-with CTX:
-    pd_historical = dhpd.to_pandas(historical)
+CTX, historical, streaming, replayed, data, ohlc = backend.get_tables()
 
 app = dash.Dash(external_stylesheets=[dbc.themes.SPACELAB])
 
+with CTX:
+    # the instruments offered by the dropdown, and the only ones the trade stream serves
+    INSTRUMENTS = list(to_pandas(historical.select_distinct("Instrument"), cols=["Instrument"]).Instrument.unique())
+
+# trades are pushed to the browser as they arrive, rather than polled for in full
+trade_broadcaster = RowBroadcaster(replayed, ["Timestamp", "Price"], key_col="Instrument")
+
+@app.server.route('/stream/trades')
+def stream_trades():
+    instrument = flask.request.args.get('instrument', 'BTC/USD')
+    # the instrument ends up in a filter, so only the known ones are accepted
+    if instrument not in INSTRUMENTS:
+        flask.abort(404)
+    with CTX:
+        trades = TABLE_CACHE.where(replayed, "Instrument == {instrument}", instrument=instrument)
+        # nothing can tick between the snapshot and the subscription while the lock is held
+        with shared_lock(replayed):
+            snapshot = snapshot_rows(trades, ["Timestamp", "Price"])
+            subscription = trade_broadcaster.subscribe(instrument)
+        TABLE_CACHE.release(trades)
+    return flask.Response(server_sent_events(subscription, trade_broadcaster, snapshot),
+                          mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 with CTX:
     app.layout = dbc.Container([
         dcc.Interval(
@@ -63,6 +58,8 @@ with CTX:
             interval=1 * 1000,  # in milliseconds
             n_intervals=0),
 
+        dcc.Store(id='trade-stream'),
+
         dbc.Row([
             html.H1(
                 'Live Cryptocurrency Analysis',
@@ -77,8 +74,7 @@ with CTX:
                         'Instrument',
                         style={'textAlign': 'center'}),
                     dcc.Dropdown(
-                        options=dhpd.to_pandas(
-                            historical.agg_by(agg.unique("Instrument"), by="Instrument")).Instrument.unique(),
+                        options=INSTRUMENTS,
                         value='BTC/USD',
                         id='instrument-selection'),
                     html.Hr(className="my-2"),
@@ -162,15 +158,24 @@ with CTX:
 
 @dash.callback(
     dash.Output('graph-content', 'figure'),
-    dash.Input('instrument-selection', 'value'),
-    dash.Input('interval-component', 'n_intervals')
+    dash.Input('instrument-selection', 'value')
 )
-def update_graph(instrument, n_intervals):
-    with CTX:
-        dff = dhpd.to_pandas(streaming.where(f"Instrument == `{instrument}`"))
-    return px.line(dff, x='Timestamp', y='Price'). \
+def update_graph(instrument):
+    # the trades themselves are filled in by the browser from /stream/trades, see assets/trade_stream.js
+    return px.line(pd.DataFrame({'Timestamp': pd.Series(dtype='datetime64[ns]'), 'Price': pd.Series(dtype='float64')}),
+                   x='Timestamp', y='Price'). \
         add_vrect(x0="2021-09-22T16:15:00 ET", x1="2021-09-22T16:13:00 ET", fillcolor="gold", opacity=1)
 
+app.clientside_callback(
+    dash.ClientsideFunction(namespace='trade_stream', function_name='follow'),
+    dash.Output('trade-stream', 'data'),
+    dash.Input('graph-content', 'figure'),
+    dash.State('instrument-selection', 'value')
+)
+
+OHLC_COLS = ['CurrentOpen', 'OpenDelta', 'CurrentHigh', 'HighDelta',
+             'CurrentLow', 'LowDelta', 'CurrentClose', 'CloseDelta']
+
 @dash.callback(
     dash.Output('open-value-card', 'children'),
     dash.Output('open-delta-card', 'children'),
@@ -186,35 +191,7 @@ def update_graph(instrument, n_intervals):
 )
 def update_ohlc(instrument, period, n_intervals):
     with CTX:
-        current_ohlc = relative_time_window(table=data,
-                                            ts_col="Timestamp",
-                                            window=timedelta(seconds=period),
-                                            snap=timedelta(seconds=5)). \
-            where(f"Instrument == `{instrument}`"). \
-            agg_by([
-            agg.last("CurrentOpen=Price"),
-            agg.max_("CurrentHigh=Price"),
-            agg.min_("CurrentLow=Price"),
-            agg.first("CurrentClose=Price")])
-        previous_ohlc = relative_time_window(table=data,
-                                             ts_col="Timestamp",
-                                             window=timedelta(seconds=period),
-                                             offset=timedelta(seconds=period),
-                                             snap=timedelta(seconds=5)). \
-            where(f"Instrument == `{instrument}`"). \
-            agg_by([
-            agg.last("PreviousOpen=Price"),
-            agg.max_("PreviousHigh=Price"),
-            agg.min_("PreviousLow=Price"),
-            agg.first("PreviousClose=Price")])
-        ohlc = current_ohlc.natural_join(previous_ohlc, on=None). \
-            update(["OpenDelta = 100 * (CurrentOpen - PreviousOpen) / PreviousOpen",
-                    "HighDelta = 100 * (CurrentHigh - PreviousHigh) / PreviousHigh",
-                    "LowDelta = 100 * (CurrentLow - PreviousLow) / PreviousLow",
-                    "CloseDelta = 100 * (CurrentClose - PreviousClose) / PreviousClose"]). \
-            drop_columns(["PreviousOpen", "PreviousHigh", "PreviousLow", "PreviousClose"])
-
-        vals = dhpd.to_pandas(ohlc).to_dict('records')[0]
+        vals = to_pandas(ohlc.get_constituent([instrument, period]), cols=OHLC_COLS).to_dict('records')[0]
     return '${:,.2f}'.format(vals['CurrentOpen']), '{:.4}%'.format(vals['OpenDelta']), \
             '${:,.2f}'.format(vals['CurrentHigh']), '{:.4}%'.format(vals['HighDelta']), \
             '${:,.2f}'.format(vals['CurrentLow']), '{:.4}%'.format(vals['LowDelta']), \
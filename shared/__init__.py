@@ -0,0 +1 @@
+# code shared by the dashboard front ends
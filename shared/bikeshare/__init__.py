@@ -0,0 +1,2 @@
+from .flows import flow_matrix
+from .pipeline import create_tables, get_tables
@@ -0,0 +1,53 @@
+import deephaven.agg as agg
+import deephaven.numpy as dhnp
+from deephaven import merge
+from deephaven.update_graph import shared_lock
+
+# other imports
+from typing import Optional, Tuple
+
+import numpy as np
+from deephaven.table import Table
+
+# routes kept per origin station in the top flows table
+TOP_FLOWS = 10
+
+FLOW_KEYS = ["start_station_id", "end_station_id"]
+
+
+def station_flows(trip_buckets: Table) -> Table:
+    """Counts trips and their median duration per (start_station_id, end_station_id) route, year and month.
+
+    Only routes that were ridden have a row, so the table is the sparse origin-destination matrix of every month
+    in coordinate form. The year and month come from trip_buckets, see derive_tables. Like station_popularity,
+    rows with a null month hold the whole year, rows with a null year that month of every year, and rows with
+    both null all time. Medians do not roll up, so every level groups the trip buckets itself.
+    """
+    cols = FLOW_KEYS + ["year", "month", "trip_count", "duration_med"]
+    aggs = [agg.count_("trip_count"), agg.median("duration_med = duration_minutes")]
+
+    return merge([
+        trip_buckets.agg_by(aggs, by = FLOW_KEYS + ["year", "month"]).view(cols),
+        trip_buckets.agg_by(aggs, by = FLOW_KEYS + ["year"]).update_view("month = NULL_INT").view(cols),
+        trip_buckets.agg_by(aggs, by = FLOW_KEYS + ["month"]).update_view("year = NULL_INT").view(cols),
+        trip_buckets.agg_by(aggs, by = FLOW_KEYS).update_view(["year = NULL_INT", "month = NULL_INT"]).view(cols)])
+
+
+def top_flows(flows: Table, k: int = TOP_FLOWS) -> Table:
+    """Keeps the k busiest routes out of every origin station, per year and month of flows."""
+    return flows.\
+        sort_descending("trip_count").\
+        head_by(k, by = ["start_station_id", "year", "month"])
+
+
+def flow_matrix(flows: Table, year: Optional[int] = None, month: Optional[int] = None) -> Tuple[np.ndarray, ...]:
+    """Returns the origin-destination matrix of one bucket of flows as COO arrays.
+
+    The result is (start_station_id, end_station_id, trip_count, duration_med), one entry per route ridden in
+    the given year and month, where None stands for all of them like the null rows of station_flows.
+    """
+    bucket = flows.where(["isNull(year)" if year is None else f"year == {int(year)}",
+                          "isNull(month)" if month is None else f"month == {int(month)}"])
+    with shared_lock(bucket):
+        return tuple(dhnp.to_numpy(bucket.view(col)).ravel()
+                     for col in FLOW_KEYS + ["trip_count", "duration_med"])
@@ -0,0 +1,303 @@
+from deephaven import read_csv, merge
+import deephaven.agg as agg
+import deephaven.updateby as uby
+
+# other imports
+import os
+import threading
+from typing import Optional
+
+from deephaven.table import Table
+
+from .flows import station_flows, top_flows
+from .snapshot import load_snapshot
+from .streaming import replay_trips
+
+# raw subscriber types containing a pattern are folded into its category, rules are applied in order
+SUBSCRIBER_TYPE_RULES = [
+    ("24", "24-Hour Vendor"),
+    ("RideScout", "24-Hour Vendor"),
+    ("Republic", "24-Hour Vendor"),
+    ("Annual", "Annual Membership"),
+    ("Local365", "Annual Membership"),
+    ("Semester", "Semester Membership"),
+    ("Local30", "30-Day Membership"),
+    ("7-Day", "7-Day Membership"),
+    ("Weekender", "Weekend Membership"),
+    ("Explorer", "1-Day Membership"),
+    ("Founding", "Founding Member"),
+    ("Try Before", "Trial Membership"),
+    ("ACL", "ACL")
+]
+
+# levels of the calendar hierarchy from finest to coarsest, with the keys identifying a group at each level
+CALENDAR_LEVELS = [
+    ("day", ["day", "month", "year"]),
+    ("month", ["month", "year"]),
+    ("year", ["year"])
+]
+
+# tables are built once per data directory and mode, and shared by every front end running in this process
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+# replayers feeding the streaming tables, kept here so they live as long as the tables do
+_REPLAYERS = {}
+
+
+def get_tables(data_dir: str, replay_speed: Optional[float] = None) -> dict:
+    """Returns the bikeshare tables for data_dir, building them on first use.
+
+    If replay_speed is given, trips are replayed as a ticking feed at that speed and every derived table
+    updates incrementally as they arrive, see create_tables.
+    """
+    key = (os.path.abspath(data_dir), replay_speed)
+    with _TABLES_LOCK:
+        if key not in _TABLES:
+            _TABLES[key] = create_tables(data_dir, replay_speed)
+        return _TABLES[key]
+
+
+def create_tables(data_dir: str, replay_speed: Optional[float] = None) -> dict:
+    """Builds every bikeshare table from the cleaned snapshot of the CSVs in data_dir.
+
+    With a replay_speed, trips is an append-only table replayed from the snapshot in start_time order, with
+    the time between trips compressed by replay_speed.
+    """
+    cleaned = load_snapshot(data_dir, lambda: clean_tables(data_dir))
+    trips = cleaned["trips"]
+
+    if replay_speed is not None:
+        trips, replayer = replay_trips(trips, replay_speed)
+        _REPLAYERS[(os.path.abspath(data_dir), replay_speed)] = replayer
+
+    return derive_tables(cleaned["stations"], trips)
+
+
+def clean_tables(data_dir: str) -> dict:
+    """Reads the raw bikeshare CSVs in data_dir and cleans them."""
+
+    stations = read_csv(os.path.join(data_dir, "austin_bikeshare_stations.csv"))
+    trips = read_csv(os.path.join(data_dir, "austin_bikeshare_trips.csv"))
+
+    # drop unwanted columns, filter rows, change types
+    stations = stations.drop_columns("location")
+    trips = trips.\
+        drop_columns(["month", "year", "checkout_time", "end_station_name", "start_station_name"]).\
+        update(["bikeid = (int)bikeid",
+                "end_station_id = (int)end_station_id",
+                "start_station_id = (int)start_station_id"]).\
+        where(["!isNull(end_station_id)",
+               "!isNull(start_station_id)"]).\
+        update("start_time = parseInstant(start_time.replace(` `, `T`).concat(` CT`))")
+
+    # aggregate subscriber_type into fewer categories and eliminate subscriber types with fewer than 100 subs
+    trips = normalize_subscriber_types(trips.where("!isNull(subscriber_type)"))
+
+    trips = trips.\
+        join(trips.count_by("sub_count", by = "subscriber_type"), on = "subscriber_type", joins = "sub_count").\
+        where("sub_count >= 100").\
+        drop_columns("sub_count")
+
+    return {
+        "stations": stations,
+        "trips": trips
+    }
+
+
+def normalize_subscriber_types(trips: Table) -> Table:
+    """Maps subscriber_type onto the categories in SUBSCRIBER_TYPE_RULES.
+
+    The rules are evaluated once per distinct raw subscriber type, and the result is joined back onto the trips.
+    """
+    subscriber_types = trips.\
+        select_distinct("raw_subscriber_type = subscriber_type").\
+        update(["subscriber_type = raw_subscriber_type"] +
+               [f"subscriber_type = subscriber_type.contains(`{pattern}`) ? `{category}` : subscriber_type"
+                for pattern, category in SUBSCRIBER_TYPE_RULES])
+
+    return trips.\
+        rename_columns("raw_subscriber_type = subscriber_type").\
+        natural_join(subscriber_types, on = "raw_subscriber_type", joins = "subscriber_type").\
+        view([column.name for column in trips.columns])
+
+
+def rollup_buckets(trip_buckets: Table, ts_col: str) -> Table:
+    """Computes the trip count and duration statistics of every ts_col bucket of trip_buckets, sorted by bucket."""
+    return trip_buckets.\
+        agg_by([agg.count_("trip_count"),
+                agg.sum_("duration_sum = duration_minutes"),
+                agg.avg("duration_avg = duration_minutes"),
+                agg.median("duration_med = duration_minutes"),
+                agg.std("duration_std = duration_minutes")], by = [ts_col, "day", "month", "year"]).\
+        rename_columns(f"timestamp = {ts_col}").\
+        sort("timestamp")
+
+
+def calendar_stats(table: Table, value_col: str, levels: list) -> dict:
+    """Computes the avg and std of value_col at every level of a calendar hierarchy, keyed by level name.
+
+    Counts, sums and sums of squares are aggregated from table once at the finest level, and every coarser
+    level merges the level below it, so the table itself is only grouped a single time.
+    """
+    moments = table.\
+        update_view(f"sq = (double){value_col} * {value_col}").\
+        agg_by([agg.count_("n"),
+                agg.sum_(f"s = {value_col}"),
+                agg.sum_("ss = sq")], by = levels[0][1])
+
+    stats = {}
+    for i, (level, keys) in enumerate(levels):
+        if i > 0:
+            moments = moments.agg_by(agg.sum_(["n", "s", "ss"]), by = keys)
+        stats[level] = moments.\
+            view(keys + [f"avg_by_{level} = (double)s / n",
+                         f"std_by_{level} = sqrt((ss - (double)s * s / n) / (n - 1))"])
+    return stats
+
+
+def station_popularity(trip_buckets: Table) -> Table:
+    """Counts trips per station_id, direction ("start" or "end"), year and month of their start_time.
+
+    The year and month come from trip_buckets, so no time zone math is repeated here. Rows with a null month hold
+    the count over the whole year, rows with a null year the count over that month of every year, and rows with
+    both null the count over all time, so any selection is a lookup.
+    """
+    keys = ["station_id", "direction"]
+    cols = keys + ["year", "month", "trip_count"]
+
+    by_month = merge([
+        trip_buckets.view(["station_id = start_station_id", "direction = `start`", "year", "month"]),
+        trip_buckets.view(["station_id = end_station_id", "direction = `end`", "year", "month"])]).\
+        count_by("trip_count", by = keys + ["year", "month"])
+
+    # the rollups aggregate the monthly counts, which are a few thousand rows rather than every trip
+    return merge([
+        by_month.view(cols),
+        by_month.agg_by(agg.sum_("trip_count"), by = keys + ["year"]).update_view("month = NULL_INT").view(cols),
+        by_month.agg_by(agg.sum_("trip_count"), by = keys + ["month"]).update_view("year = NULL_INT").view(cols),
+        by_month.agg_by(agg.sum_("trip_count"), by = keys).update_view(["year = NULL_INT", "month = NULL_INT"]).view(cols)])
+
+
+def derive_tables(stations: Table, trips: Table) -> dict:
+    """Builds the frequency and duration tables from the cleaned stations and trips tables."""
+
+    ### Time bucketing
+
+    # every time key is derived from start_time once, and all frequency and duration tables aggregate this table
+    trip_buckets = trips.\
+        select(["start_station_id",
+                "end_station_id",
+                "duration_minutes",
+                "local_date = toLocalDate(start_time, 'CT')",
+                "hour = hourOfDay(start_time, 'CT')",
+                "hour = hour == 24 ? 23 : hour",
+                "hour_timestamp = toInstant(local_date, millisOfDayToLocalTime((hour * 60 * 60 * 1000)), 'CT')",
+                "day_timestamp = toInstant(local_date, millisOfDayToLocalTime(0), 'CT')",
+                "day = local_date.getDayOfYear()",
+                "month = local_date.getMonthValue()",
+                "year = local_date.getYear()"]).\
+        drop_columns(["local_date", "hour"])
+
+    # trip count and duration statistics per bucket come out of a single grouping pass
+    hourly_ride_rollup = rollup_buckets(trip_buckets, "hour_timestamp")
+    daily_ride_rollup = rollup_buckets(trip_buckets, "day_timestamp")
+
+
+    ### Frequency analysis
+
+    # hourly and daily trip count
+    hourly_ride_freq = hourly_ride_rollup.\
+        view(["timestamp", "trip_count", "day", "month", "year"])
+
+    hourly_ride_freq_by = calendar_stats(hourly_ride_freq, "trip_count", CALENDAR_LEVELS)
+
+    hourly_ride_freq_stats = hourly_ride_freq_by["day"].\
+        natural_join(hourly_ride_freq_by["month"], on = ["month", "year"], joins = ["avg_by_month", "std_by_month"]).\
+        natural_join(hourly_ride_freq_by["year"], on = "year", joins = ["avg_by_year", "std_by_year"])
+
+
+    daily_ride_freq = daily_ride_rollup.\
+        view(["timestamp", "trip_count", "day", "month", "year"])
+
+    daily_ride_freq_by = calendar_stats(daily_ride_freq, "trip_count", CALENDAR_LEVELS[1:])
+
+    daily_ride_freq_stats = daily_ride_freq_by["month"].\
+        natural_join(daily_ride_freq_by["year"], on = "year", joins = ["avg_by_year", "std_by_year"])
+
+
+    # hourly trip rolling average and standardization
+    hourly_ride_freq_avg = hourly_ride_freq.\
+        update_by(uby.rolling_avg_tick("trip_count_avg = trip_count", rev_ticks = 24, fwd_ticks = 24)).\
+        natural_join(hourly_ride_freq_by["month"], on = ["month", "year"], joins = ["avg_by_month", "std_by_month"]).\
+        update("standardized_trip_count = (trip_count - avg_by_month) / std_by_month").\
+        update_by(uby.rolling_avg_tick("standardized_trip_count_avg = standardized_trip_count", rev_ticks = 12, fwd_ticks = 12), by = ["month", "year"])
+
+    # daily trip count rolling average and standardization
+    daily_ride_freq_avg = daily_ride_freq.\
+        update_by(uby.rolling_avg_tick("trip_count_avg = trip_count", rev_ticks = 15, fwd_ticks = 15)).\
+        where(["year > 2013", "year < 2017"]).\
+        natural_join(daily_ride_freq_by["year"], on = "year", joins = ["avg_by_year", "std_by_year"]).\
+        update("standardized_trip_count = (trip_count - avg_by_year) / std_by_year").\
+        update_by(uby.rolling_avg_tick("standardized_trip_count_avg = standardized_trip_count", rev_ticks = 15, fwd_ticks = 15), by = "year")
+
+
+    ### Duration analysis
+
+    hourly_ride_dur = hourly_ride_rollup.\
+        view(["timestamp", "duration_sum", "duration_avg", "duration_med", "day", "month", "year"])
+
+    hourly_ride_dur_avg = hourly_ride_dur.\
+        update_by(uby.rolling_avg_time("timestamp",
+            ["duration_avg_sum = duration_sum",
+             "duration_avg_avg = duration_avg",
+             "duration_avg_med = duration_med"],
+            rev_time = "PT24h", fwd_time = "PT24h"))
+
+    daily_ride_dur = daily_ride_rollup.\
+        view(["timestamp", "duration_sum", "duration_avg", "duration_med", "day", "month", "year"])
+
+    daily_ride_dur_avg = daily_ride_dur.\
+        update_by(uby.rolling_avg_time("timestamp",
+            ["duration_avg_sum = duration_sum",
+             "duration_avg_avg = duration_avg",
+             "duration_avg_med = duration_med"],
+            rev_time = "P15D", fwd_time = "P15D"))
+
+
+    ### Station popularity
+
+    station_trip_counts = station_popularity(trip_buckets)
+
+    # origin-destination flows, and the busiest routes out of every station
+    flows = station_flows(trip_buckets)
+    busiest_flows = top_flows(flows)
+
+
+    ### Partitioned views
+
+    # front ends select a single month of the hourly tables, which is a constituent lookup on these
+    hourly_ride_freq_avg_by_month = hourly_ride_freq_avg.partition_by(["year", "month"])
+    hourly_ride_dur_avg_by_month = hourly_ride_dur_avg.partition_by(["year", "month"])
+
+    return {
+        "stations": stations,
+        "trips": trips,
+        "hourly_ride_rollup": hourly_ride_rollup,
+        "daily_ride_rollup": daily_ride_rollup,
+        "hourly_ride_freq": hourly_ride_freq,
+        "hourly_ride_freq_stats": hourly_ride_freq_stats,
+        "hourly_ride_freq_avg": hourly_ride_freq_avg,
+        "hourly_ride_freq_avg_by_month": hourly_ride_freq_avg_by_month,
+        "daily_ride_freq": daily_ride_freq,
+        "daily_ride_freq_stats": daily_ride_freq_stats,
+        "daily_ride_freq_avg": daily_ride_freq_avg,
+        "hourly_ride_dur": hourly_ride_dur,
+        "hourly_ride_dur_avg": hourly_ride_dur_avg,
+        "hourly_ride_dur_avg_by_month": hourly_ride_dur_avg_by_month,
+        "daily_ride_dur": daily_ride_dur,
+        "daily_ride_dur_avg": daily_ride_dur_avg,
+        "station_trip_counts": station_trip_counts,
+        "station_flows": flows,
+        "station_top_flows": busiest_flows
+    }
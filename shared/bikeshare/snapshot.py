@@ -0,0 +1,82 @@
+from deephaven import parquet
+
+# other imports
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from typing import Callable, Dict
+
+from deephaven.table import Table
+
+# bump this whenever the cleaning steps change, so that snapshots written by older code are not reused
+CLEANING_VERSION = 1
+
+SNAPSHOT_DIR = ".snapshots"
+SOURCE_FILES = ("austin_bikeshare_stations.csv", "austin_bikeshare_trips.csv")
+
+# seconds after its last write before a temporary snapshot directory is taken to be abandoned
+TMP_MAX_AGE = 6 * 60 * 60
+
+
+def snapshot_key(data_dir: str) -> str:
+    """Fingerprints the source CSVs by name, size and modification time."""
+    h = hashlib.sha256(f"v{CLEANING_VERSION}".encode())
+    for name in SOURCE_FILES:
+        st = os.stat(os.path.join(data_dir, name))
+        h.update(f"|{name}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()[:16]
+
+
+def sweep_snapshots(root: str, keep: str) -> None:
+    """Removes every snapshot under root other than keep, along with temporary directories left by crashed writers.
+
+    Writers in other containers share the data directory but not the process table, so a temporary directory,
+    <key>.<random>.tmp, is only removed once nothing has been written to it for TMP_MAX_AGE seconds.
+    """
+    for name in os.listdir(root):
+        if name == keep:
+            continue
+        path = os.path.join(root, name)
+        if name.endswith(".tmp"):
+            try:
+                if time.time() - os.stat(path).st_mtime < TMP_MAX_AGE:
+                    continue
+            except FileNotFoundError:
+                # renamed into place or removed while listing
+                continue
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def load_snapshot(data_dir: str, build: Callable[[], Dict[str, Table]]) -> Dict[str, Table]:
+    """Loads the cleaned tables from a Parquet snapshot of data_dir, or builds and writes one if it is missing or stale.
+
+    build() must return the cleaned tables keyed by name; they are written as <name>.parquet.
+    """
+    root = os.path.join(data_dir, SNAPSHOT_DIR)
+    path = os.path.join(root, snapshot_key(data_dir))
+
+    if os.path.isdir(path):
+        sweep_snapshots(root, os.path.basename(path))
+        return {file[:-len(".parquet")]: parquet.read(os.path.join(path, file))
+                for file in sorted(os.listdir(path)) if file.endswith(".parquet")}
+
+    tables = build()
+
+    # write to a temporary directory first so a crash never leaves a half written snapshot behind
+    # the name is random rather than the pid, which is not unique across containers sharing the directory
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(tmp_path)
+    for name, table in tables.items():
+        parquet.write(table, os.path.join(tmp_path, name + ".parquet"))
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # another process finished the same snapshot first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    # snapshots of older versions of the source files are never read again
+    sweep_snapshots(root, os.path.basename(path))
+
+    return tables
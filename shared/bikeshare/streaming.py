@@ -0,0 +1,29 @@
+from deephaven import agg
+from deephaven.replay import TableReplayer
+import deephaven.numpy as dhnp
+import deephaven.time as dhtu
+
+# other imports
+from typing import Tuple
+
+from deephaven.table import Table
+
+
+def replay_trips(trips: Table, speed: float) -> Tuple[Table, TableReplayer]:
+    """Replays the static trips table as an append-only ticking table, in start_time order.
+
+    The time between trips is compressed by speed, so speed=3600 replays an hour of trips every second.
+    The replayer is returned already started, and must be kept alive for as long as the trips tick.
+    """
+    bounds = dhnp.to_numpy(trips.agg_by([agg.min_("first = start_time"), agg.max_("last = start_time")]))[0]
+    first_time = dhtu.to_j_instant(bounds[0])
+    replay_end = dhtu.to_j_instant(bounds[0] + (bounds[1] - bounds[0]) / speed)
+
+    trips = trips.\
+        update(f"replay_time = plus(first_time, (long)(minus(start_time, first_time) / {speed}))").\
+        sort("replay_time")
+
+    replayer = TableReplayer(first_time, replay_end)
+    replayed = replayer.add_table(trips, "replay_time").drop_columns("replay_time")
+    replayer.start()
+    return replayed, replayer
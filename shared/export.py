@@ -0,0 +1,99 @@
+import deephaven.pandas as dhpd
+from deephaven.table_listener import listen
+from deephaven.update_graph import shared_lock
+
+# other imports
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import pandas as pd
+from deephaven.table import Table
+
+
+def to_pandas(
+        table: Table,
+        cols: Optional[Sequence[str]] = None,
+        rows: Optional[slice] = None,
+        dtype_backend: Optional[str] = "numpy_nullable") -> pd.DataFrame:
+    """Converts the cols columns and rows row range of table to pandas, without reading anything else.
+
+    rows is a slice over row positions, e.g. slice(0, 100) for the first hundred rows or slice(-10, None)
+    for the last ten. dtype_backend is passed on to deephaven.pandas.to_pandas: with None, numeric columns
+    come back as plain numpy arrays that keep Deephaven's null sentinels rather than being converted to
+    nullable types, and "pyarrow" gives Arrow-backed columns. Every backend copies the exported columns out
+    of Deephaven, so the saving comes from exporting fewer columns and rows, not from avoiding the copy.
+    """
+    conv_null = dtype_backend is not None
+    with shared_lock(table):
+        if rows is not None:
+            start, stop, step = rows.indices(table.size)
+            if step != 1:
+                raise ValueError(f"cannot export every {step}th row, rows must be a contiguous range")
+            table = table.slice(start, max(start, stop))
+        return dhpd.to_pandas(table, cols=list(cols) if cols is not None else None,
+                              dtype_backend=dtype_backend, conv_null=conv_null)
+
+
+class ChangeCursor:
+    """Exports the rows a ticking table added, modified and removed since the previous fetch.
+
+    A listener on the table collects the cols values of every changed row as updates arrive, so a fetch costs
+    time proportional to the rows that changed rather than to the size of the table. Deephaven does not hand
+    row keys to Python, so cols should include the columns that identify a row for the caller.
+    """
+
+    def __init__(self, table: Table, cols: Sequence[str], max_rows: int = 1_000_000):
+        self.table = table
+        self.cols = list(cols)
+        self.max_rows = max_rows
+        self._changes = []
+        self._rows = 0
+        self._overflowed = False
+        self._started = False
+        self._lock = threading.Lock()
+        self._handle = listen(table, self._on_update, description="ChangeCursor")
+
+    def fetch(self) -> Tuple[pd.DataFrame, bool]:
+        """Returns the changes since the previous fetch, and whether they start over from a full snapshot.
+
+        The changes are the cols of each changed row plus a "change" column of "removed", "added" or "modified",
+        in the order they happened, so applying them row by row brings a copy of the table up to date; modified
+        rows hold their new values. The first fetch, and any fetch after more than max_rows changed rows went
+        uncollected, instead returns every row of the table as "added", and True, and the caller should drop
+        its copy first.
+        """
+        with shared_lock(self.table):
+            with self._lock:
+                reset = self._overflowed or not self._started
+                changes, self._changes, self._rows, self._overflowed = self._changes, [], 0, False
+                self._started = True
+            if reset:
+                # nothing ticks while the lock is held, so the snapshot lines up with the changes collected after it
+                frame = to_pandas(self.table, self.cols)
+                frame["change"] = "added"
+                return frame, True
+
+        frames = [pd.DataFrame(rows).assign(change=kind) for kind, rows in changes]
+        if not frames:
+            return pd.DataFrame(columns=self.cols + ["change"]), False
+        return pd.concat(frames, ignore_index=True), False
+
+    def close(self) -> None:
+        """Stops listening to the table."""
+        self._handle.stop()
+
+    def _on_update(self, update, is_replay: bool) -> None:
+        batches: List[Tuple[str, dict]] = [("removed", update.removed(self.cols)),
+                                           ("added", update.added(self.cols)),
+                                           ("modified", update.modified(self.cols))]
+        with self._lock:
+            # until the first fetch, and after an overflow, the next fetch is a snapshot anyway
+            if self._overflowed or not self._started:
+                return
+            for kind, rows in batches:
+                if rows and len(rows[self.cols[0]]) > 0:
+                    self._changes.append((kind, rows))
+                    self._rows += len(rows[self.cols[0]])
+            if self._rows > self.max_rows:
+                # a caller that does not keep up starts over from a snapshot instead of an ever growing backlog
+                self._changes, self._rows, self._overflowed = [], 0, True
@@ -0,0 +1,29 @@
+# other imports
+from typing import Callable, Optional, Sequence, Tuple, Union
+
+from deephaven.table import Table
+
+from .table_cache import normalize_filters
+
+
+class FigureTables:
+    """Builds the tables backing the series of one figure.
+
+    Series asking for structurally identical tables, the same source with the same normalized filters and bound
+    parameters, share a single table instead of each adding their own to the update graph. Tables are built with
+    where_fn(source, filters), which defaults to a plain Table.where and can route through a TableLease instead.
+    """
+
+    def __init__(self, where_fn: Optional[Callable[[Table, Tuple[str, ...]], Table]] = None):
+        self._where_fn = where_fn if where_fn is not None else lambda source, filters: source.where(list(filters))
+        self._tables = {}
+
+    def where(self, source: Table, filters: Union[str, Sequence[str]], **params) -> Table:
+        """Returns source filtered by filters, with params bound into their {name} placeholders."""
+        key = (id(source), normalize_filters(filters, params))
+        if key not in self._tables:
+            self._tables[key] = self._where_fn(source, key[1])
+        return self._tables[key]
+
+    def __len__(self) -> int:
+        return len(self._tables)
@@ -0,0 +1,55 @@
+# other imports
+import datetime as dt
+import functools
+import hashlib
+import inspect
+from typing import Any, Callable, Hashable
+
+from deephaven.table import PartitionedTable, Table
+
+from .table_cache import TableCache
+
+
+def _arg_key(value: Any) -> Hashable:
+    # tables are keyed by identity, everything else by value
+    if isinstance(value, (Table, PartitionedTable)):
+        return ("table", id(value))
+    if value is None or isinstance(value, (bool, int, float, str, dt.date, dt.datetime, dt.time)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(_arg_key(item) for item in value))
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted((key, _arg_key(item)) for key, item in value.items())))
+    raise TypeError(f"cannot key a live cache on {type(value).__name__} value {value!r}")
+
+
+def live_cache(func: Callable = None, *, cache: TableCache = None):
+    """Caches the live tables or figures returned by func, keyed on its source code and bound arguments.
+
+    The cache lives in this module rather than in the calling script, so it survives Streamlit reruns and is
+    shared by every session: calling func again with the same arguments, from the same code, returns the same
+    live object instead of building another one. Tables passed as arguments are keyed by identity and kept
+    alive along with the result. Results are reference counted like the tables of a TableCache: every call
+    acquires one, and a session hands it back by holding it in a TableLease on the same cache, so only the
+    results no session is showing are evicted.
+    """
+    if func is None:
+        return lambda f: live_cache(f, cache=cache)
+    cache = cache if cache is not None else LIVE_CACHE
+
+    name = f"{func.__module__}.{func.__qualname__}:{hashlib.sha256(inspect.getsource(func).encode()).hexdigest()}"
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (name,) + tuple((arg, _arg_key(value)) for arg, value in bound.arguments.items())
+        return cache.acquire(key, list(bound.arguments.values()), lambda: func(*args, **kwargs))
+
+    wrapper.cache = cache
+    return wrapper
+
+
+# the cache shared by every live_cache function in this process
+LIVE_CACHE = TableCache(capacity=128)
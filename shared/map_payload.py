@@ -0,0 +1,74 @@
+import deephaven.numpy as dhnp
+from deephaven.update_graph import shared_lock
+
+# other imports
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from deephaven.table import Table
+
+
+def hex_to_rgba(colors: np.ndarray, alpha: int = 255) -> np.ndarray:
+    """Converts an array of "#RRGGBB" strings to an (n, 4) uint8 array of RGBA values."""
+    rgb = np.array([int(color.lstrip("#"), 16) for color in colors], dtype=np.uint32)
+    rgba = np.empty((len(rgb), 4), dtype=np.uint8)
+    rgba[:, 0] = rgb >> 16
+    rgba[:, 1] = (rgb >> 8) & 0xFF
+    rgba[:, 2] = rgb & 0xFF
+    rgba[:, 3] = alpha
+    return rgba
+
+
+class PointPayload:
+    """A layer of map points as typed arrays: int32 ids, float32 latitudes, longitudes and sizes, uint8 RGBA colors.
+
+    Only the read from Deephaven is typed. The map widgets in use take a DataFrame, see to_frame, and redraw the
+    whole layer on every change, so there is no binary encoding or size diff to send.
+    """
+
+    def __init__(self, ids: np.ndarray, lat: np.ndarray, lon: np.ndarray, size: np.ndarray, rgba: np.ndarray):
+        self.ids = ids.astype(np.int32, copy=False)
+        self.lat = lat.astype(np.float32, copy=False)
+        self.lon = lon.astype(np.float32, copy=False)
+        self.size = size.astype(np.float32, copy=False)
+        self.rgba = rgba.astype(np.uint8, copy=False)
+
+    @classmethod
+    def from_table(
+            cls,
+            table: Table,
+            id_col: str,
+            lat_col: str,
+            lon_col: str,
+            color_col: str,
+            size_col: Optional[str] = None,
+            size: float = 25.0,
+            size_total: Optional[float] = None) -> "PointPayload":
+        """Reads a layer straight from the columns of table.
+
+        Without size_col every point gets size. With it, sizes are size_col scaled so that they add up to
+        size_total if given.
+        """
+        cols = [id_col, lat_col, lon_col, color_col] + ([size_col] if size_col is not None else [])
+        with shared_lock(table):
+            values = {col: dhnp.to_numpy(table.view(col)).ravel() for col in cols}
+
+        if size_col is None:
+            sizes = np.full(len(values[id_col]), size, dtype=np.float32)
+        else:
+            sizes = values[size_col].astype(np.float32)
+            if size_total is not None and sizes.sum() > 0:
+                sizes *= size_total / sizes.sum()
+        return cls(values[id_col], values[lat_col], values[lon_col], sizes, hex_to_rgba(values[color_col]))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Wraps the arrays in a DataFrame for map widgets that take one, such as st.map.
+
+        Colors are given as lists of Python ints, since st.map rejects numpy arrays as colors.
+        """
+        return pd.DataFrame({"latitude": self.lat, "longitude": self.lon, "size": self.size,
+                             "color": self.rgba.tolist()})
@@ -0,0 +1,132 @@
+from deephaven.table_listener import listen
+import deephaven.numpy as dhnp
+
+# other imports
+import json
+import queue
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+from deephaven.table import Table
+
+
+def _to_json_values(values: np.ndarray) -> List[Any]:
+    if np.issubdtype(values.dtype, np.datetime64):
+        # plotly ignores time zones, so send the same naive UTC strings it gets from a figure
+        return np.datetime_as_string(values, unit="ms").tolist()
+    return values.tolist()
+
+
+def snapshot_rows(table: Table, cols: Sequence[str]) -> Dict[str, List[Any]]:
+    """Returns the current rows of table as a JSON-ready dict of column name to values."""
+    return {col: _to_json_values(dhnp.to_numpy(table.view(col)).ravel()) for col in cols}
+
+
+class Subscription:
+    """The batches of rows pushed to one subscriber, see RowBroadcaster.subscribe."""
+
+    def __init__(self, key: Any, max_batches: int):
+        self.key = key
+        self.closed = False
+        self._batches = queue.Queue(maxsize=max_batches)
+
+    def get(self, timeout: float) -> Optional[Dict[str, List[Any]]]:
+        """Returns the next batch, or None if there was none within timeout seconds."""
+        try:
+            return self._batches.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class RowBroadcaster:
+    """Pushes the rows added to a table to its subscribers as they arrive.
+
+    A single listener on the table reads only the added rows of every update, so the work done per update
+    grows with the number of rows added rather than with the size of the table. Subscribers can ask for the
+    rows of a single key_col value. A subscriber that does not keep up with the updates is closed instead of
+    holding on to an ever growing backlog.
+    """
+
+    def __init__(self, table: Table, cols: Sequence[str], key_col: Optional[str] = None, max_batches: int = 256):
+        self.table = table
+        self.cols = list(cols)
+        self.key_col = key_col
+        self.max_batches = max_batches
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._handle = listen(table, self._on_update, description="RowBroadcaster")
+
+    def subscribe(self, key: Any = None) -> Subscription:
+        """Returns a subscription to the rows added from now on, limited to those whose key_col equals key if given.
+
+        Subscribe while holding the update graph lock of the table to line the subscription up with a snapshot
+        taken under the same lock: every row added after the snapshot is pushed, and none of those in it.
+        """
+        subscription = Subscription(key, self.max_batches)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Stops pushing rows to subscription."""
+        subscription.closed = True
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def stop(self) -> None:
+        """Stops listening to the table and closes every subscription."""
+        self._handle.stop()
+        with self._lock:
+            for subscription in self._subscriptions:
+                subscription.closed = True
+            self._subscriptions.clear()
+
+    def _on_update(self, update, is_replay: bool) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        if not subscriptions:
+            return
+
+        cols = self.cols if self.key_col is None or self.key_col in self.cols else self.cols + [self.key_col]
+        added = update.added(cols)
+        if not added or len(added[cols[0]]) == 0:
+            return
+
+        batches = {}
+        for subscription in subscriptions:
+            if subscription.key not in batches:
+                if subscription.key is None:
+                    rows = added
+                else:
+                    mask = added[self.key_col] == subscription.key
+                    rows = {col: added[col][mask] for col in self.cols} if mask.any() else None
+                batches[subscription.key] = {col: _to_json_values(rows[col]) for col in self.cols} if rows else None
+
+            batch = batches[subscription.key]
+            if batch is None:
+                continue
+            try:
+                subscription._batches.put_nowait(batch)
+            except queue.Full:
+                self.unsubscribe(subscription)
+
+
+def server_sent_events(subscription: Subscription, broadcaster: RowBroadcaster,
+                       snapshot: Optional[Dict[str, List[Any]]] = None, keepalive: float = 15.0) -> Iterator[str]:
+    """Streams a subscription as server-sent events, starting with a "reset" event carrying snapshot if given.
+
+    Every batch of rows is sent as an "append" event holding a JSON object of column name to values. The
+    subscription is dropped once the client goes away, which is noticed at the latest on the next keepalive.
+    """
+    try:
+        if snapshot is not None:
+            yield f"event: reset\ndata: {json.dumps(snapshot)}\n\n"
+        while not subscription.closed:
+            batch = subscription.get(timeout=keepalive)
+            if batch is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: append\ndata: {json.dumps(batch)}\n\n"
+    finally:
+        broadcaster.unsubscribe(subscription)
@@ -0,0 +1,460 @@
+import deephaven.agg as agg
+from deephaven.execution_context import get_exec_ctx
+
+# other imports
+import ast
+import functools
+import math
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from deephaven.table import Table
+
+from .table_cache import TABLE_CACHE, TableCache, normalize_expression
+
+# table operations a query may chain, their formula and filter strings are checked by check_formulas
+QUERY_METHODS = frozenset([
+    "where", "where_in", "where_not_in", "where_one_of",
+    "view", "update_view", "update", "lazy_update", "select", "select_distinct",
+    "drop_columns", "rename_columns", "move_columns", "move_columns_up", "move_columns_down",
+    "sort", "sort_descending", "reverse", "flatten",
+    "head", "tail", "slice", "head_pct", "tail_pct", "head_by", "tail_by",
+    "count_by", "sum_by", "abs_sum_by", "avg_by", "median_by", "min_by", "max_by", "std_by", "var_by",
+    "first_by", "last_by", "group_by", "ungroup", "agg_by", "agg_all_by",
+    "natural_join", "exact_join", "join", "aj", "raj",
+])
+
+# aggregations a query may pass to agg_by and agg_all_by, as agg.<name>(...)
+AGGREGATIONS = frozenset([
+    "abs_sum", "avg", "count_", "count_distinct", "count_where", "distinct", "first", "formula", "group", "last",
+    "max_", "median", "min_", "pct", "sorted_first", "sorted_last", "std", "sum_", "unique", "var",
+    "weighted_avg", "weighted_sum",
+])
+
+
+# methods that lead from a value to its class, and from there to any other class, refused anywhere in a formula
+BLOCKED_FORMULA_METHODS = frozenset([
+    "getClass", "forName", "getRuntime", "exec", "invoke", "getMethod", "getMethods", "getDeclaredMethod",
+    "getDeclaredMethods", "getConstructor", "getDeclaredConstructor", "newInstance", "loadClass", "exit", "halt",
+])
+
+# string, character and date-time literals, which are left alone when checking a formula
+_LITERALS = re.compile(r"(`[^`]*`|'[^']*'|\"[^\"]*\")")
+# a dotted name such as col.method or java.lang.Runtime, captured by its head
+_DOTTED = re.compile(r"(?<![\w.])([A-Za-z_]\w*)(?:\s*\.\s*[A-Za-z_]\w*)+")
+_CALLED = re.compile(r"\.\s*([A-Za-z_]\w*)\s*\(")
+_NEW = re.compile(r"\bnew\b")
+# comments could split a dotted name
+_OBSCURED = re.compile(r"/\*|//")
+
+# operations that only select, rename or reorder columns, or compute them lazily
+_COLUMN_METHODS = frozenset(["view", "update_view", "lazy_update", "drop_columns", "rename_columns", "move_columns",
+                             "move_columns_up", "move_columns_down", "reverse", "flatten"])
+_FILTER_METHODS = frozenset(["where", "where_in", "where_not_in", "where_one_of"])
+_AGGREGATION_METHODS = frozenset(["count_by", "sum_by", "abs_sum_by", "avg_by", "median_by", "min_by", "max_by",
+                                  "std_by", "var_by", "first_by", "last_by", "group_by", "agg_by", "agg_all_by",
+                                  "select_distinct"])
+
+# rows an ungroup is assumed to produce per grouped row
+UNGROUP_FANOUT = 10
+
+
+class QueryError(ValueError):
+    """Raised for a query that does not parse, or that uses anything other than the whitelisted operations."""
+
+
+class QueryBudgetError(QueryError):
+    """Raised for a query that is estimated to cost more than its budget, or that runs out of time."""
+
+
+class QueryBudget:
+    """Limits on a single user query.
+
+    max_cost caps the estimated work, counted in rows touched, before anything runs. timeout is the number of
+    seconds the query may take to build, and max_rows caps the rows it returns.
+    """
+
+    def __init__(self, max_cost: float = 2e8, timeout: float = 10.0, max_rows: int = 1_000_000):
+        self.max_cost = max_cost
+        self.timeout = timeout
+        self.max_rows = max_rows
+
+
+# distinct value counts of the columns of static tables, by (id(table), column)
+_CARDINALITIES = {}
+_CARDINALITIES_LOCK = threading.Lock()
+
+
+def count_cardinalities(table: Table) -> None:
+    """Counts the distinct values of every column of a static table, once per table, for column_cardinality.
+
+    The counts are full passes over the table, so they are taken up front rather than while estimating a query,
+    and without holding the lock other estimates read them under.
+    """
+    if table.is_refreshing:
+        return
+    with _CARDINALITIES_LOCK:
+        missing = [column for column in table.column_names if (id(table), column) not in _CARDINALITIES]
+    for column in missing:
+        count = table.select_distinct(column).size
+        with _CARDINALITIES_LOCK:
+            _CARDINALITIES[(id(table), column)] = (table, count)
+
+
+def column_cardinality(table: Table, column: str) -> float:
+    """Returns the number of distinct values of column as counted by count_cardinalities.
+
+    Columns of ticking tables are guessed from the table size, and columns that were not counted are bounded by it.
+    """
+    if table.is_refreshing:
+        return math.sqrt(max(table.size, 1))
+    with _CARDINALITIES_LOCK:
+        entry = _CARDINALITIES.get((id(table), column))
+    return entry[1] if entry is not None else max(table.size, 1)
+
+
+def _strings(node: Tuple) -> Iterator[str]:
+    kind = node[0]
+    if kind == "const":
+        if isinstance(node[1], str):
+            yield node[1]
+        return
+    if kind == "table":
+        return
+    if kind == "list":
+        children = node[1]
+    elif kind == "agg":
+        children = node[2] + tuple(value for _, value in node[3])
+    else:
+        children = (node[2],) + node[3] + tuple(value for _, value in node[4])
+    for child in children:
+        yield from _strings(child)
+
+
+def check_formula(formula: str, columns: Iterable[str]) -> None:
+    """Rejects a formula or filter string that could reach outside columns.
+
+    Such strings are compiled by Deephaven's query language, which can call any Java method, so they are held
+    to calling methods on columns: a dotted name must start with one of columns, "new" is refused, and so are
+    the methods in BLOCKED_FORMULA_METHODS anywhere. Functions the query language imports by default, such as
+    monthOfYear, can still be called. Comments, backslashes, which start the unicode escapes the Java compiler
+    decodes before anything else, and quotes inside literals could all hide code from these checks, so they
+    are refused too.
+    """
+    known = columns if isinstance(columns, (set, frozenset)) else set(columns)
+    code = _LITERALS.sub(" ", formula)
+    # a quote inside a literal, or one left unmatched, could end a literal where these checks do not
+    if "\\" in formula or any(quote in code for quote in "`'\"") or \
+            any(quote in literal[1:-1] for literal in _LITERALS.findall(formula) for quote in "`'\""):
+        raise QueryError(f"{formula!r} holds a backslash or a stray quote, which queries may not use")
+    if _OBSCURED.search(code):
+        raise QueryError(f"{formula!r} holds a comment, which queries may not use")
+    if _NEW.search(code):
+        raise QueryError(f"{formula!r} creates an object, queries may only call methods on columns")
+    for match in _CALLED.finditer(code):
+        if match.group(1) in BLOCKED_FORMULA_METHODS:
+            raise QueryError(f"{formula!r} calls {match.group(1)}, which queries may not use")
+    for match in _DOTTED.finditer(code):
+        if match.group(1) not in known:
+            raise QueryError(f"{formula!r} uses {match.group(0)!r}, queries may only call methods on columns")
+
+
+def check_formulas(node: Tuple, columns: Iterable[str]) -> None:
+    """Rejects a compiled query any of whose formula or filter strings fails check_formula.
+
+    Columns a query creates itself do not count, since a name is only a column from the operation that
+    creates it on.
+    """
+    known = set(columns)
+    for string in _strings(node):
+        check_formula(string, known)
+
+
+def _compile(node: ast.AST) -> Tuple:
+    if isinstance(node, ast.Name):
+        return ("table", node.id)
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, (str, int, float, bool, type(None))):
+        value = normalize_expression(node.value) if isinstance(node.value, str) else node.value
+        return ("const", value)
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant) \
+            and isinstance(node.operand.value, (int, float)) and not isinstance(node.operand.value, bool):
+        return ("const", -node.operand.value)
+
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return ("list", tuple(_compile(item) for item in node.elts))
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        args = tuple(_compile(arg) for arg in node.args)
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                raise QueryError("**kwargs are not supported in queries")
+        kwargs = tuple(sorted((keyword.arg, _compile(keyword.value)) for keyword in node.keywords))
+
+        receiver, name = node.func.value, node.func.attr
+        if isinstance(receiver, ast.Name) and receiver.id == "agg":
+            if name not in AGGREGATIONS:
+                raise QueryError(f"agg.{name} is not an allowed aggregation")
+            return ("agg", name, args, kwargs)
+        if name not in QUERY_METHODS:
+            raise QueryError(f"{name} is not an allowed table operation")
+        receiver = _compile(receiver)
+        # table operations are only called on a named table or on the result of another one
+        if receiver[0] not in ("table", "call"):
+            raise QueryError(f"{name} can only be called on a table, not on {ast.unparse(node.func.value)!r}")
+        return ("call", name, receiver, args, kwargs)
+
+    raise QueryError(f"unsupported expression {ast.unparse(node)!r}, queries may only chain table operations")
+
+
+@functools.lru_cache(maxsize=256)
+def compile_query(query: str) -> Tuple:
+    """Parses a query into a normalized, hashable tree of table operations.
+
+    Queries that differ only in formatting, such as the whitespace around operators or between arguments,
+    compile to the same tree.
+    """
+    try:
+        tree = ast.parse(query.strip(), mode="eval")
+    except SyntaxError as e:
+        raise QueryError(f"query does not parse: {e.msg}") from None
+    return _compile(tree.body)
+
+
+def query_tables(node: Tuple) -> frozenset:
+    """Returns the names of the tables a compiled query reads."""
+    kind = node[0]
+    if kind == "table":
+        return frozenset([node[1]])
+    if kind == "const":
+        return frozenset()
+    if kind == "list":
+        children = node[1]
+    elif kind == "agg":
+        children = node[2] + tuple(value for _, value in node[3])
+    else:
+        children = (node[2],) + node[3] + tuple(value for _, value in node[4])
+    return frozenset().union(*(query_tables(child) for child in children))
+
+
+def _argument(node: Tuple, index: int, name: str) -> Optional[Tuple]:
+    args, kwargs = node[3], dict(node[4])
+    return args[index] if index < len(args) else kwargs.get(name)
+
+
+def _constant(node: Optional[Tuple]) -> Any:
+    if node is None:
+        return None
+    if node[0] == "const":
+        return node[1]
+    if node[0] == "list":
+        values = [_constant(item) for item in node[1]]
+        return None if any(value is None for value in values) else values
+    return None
+
+
+def _key_columns(node: Optional[Tuple], left: bool = True) -> List[str]:
+    # "a" or "a = b", for join keys the left or right hand side
+    keys = _constant(node)
+    if keys is None:
+        return []
+    keys = [keys] if isinstance(keys, str) else keys
+    return [key.split("=")[0 if left else -1].strip(" <>") for key in keys if isinstance(key, str)]
+
+
+def estimate_cost(node: Tuple, tables: Dict[str, Table]) -> Tuple[float, float]:
+    """Estimates the rows a compiled query returns and the work it takes to build, in rows touched.
+
+    Filters are assumed to keep every row, and the groups of an aggregation are the product of the distinct
+    counts of its key columns in the source tables, so the estimate errs on the expensive side.
+    """
+    if node[0] == "table":
+        return tables[node[1]].size, 0.0
+
+    name, rows, cost = node[1], *estimate_cost(node[2], tables)
+    sources = [tables[source] for source in sorted(query_tables(node))]
+
+    def groups(columns: List[str], limit: float) -> float:
+        count = 1.0
+        for column in columns:
+            source = next((table for table in sources if column in table.column_names), None)
+            count *= column_cardinality(source, column) if source is not None else limit
+        return min(count, limit)
+
+    if name in _COLUMN_METHODS:
+        return rows, cost
+    if name in _FILTER_METHODS:
+        return rows, cost + rows
+    if name in ("update", "select"):
+        formulas = _constant(_argument(node, 0, "formulas"))
+        return rows, cost + rows * max(1, len(formulas) if isinstance(formulas, list) else 1)
+    if name in ("sort", "sort_descending"):
+        return rows, cost + rows * math.log2(rows + 2)
+    if name in ("head", "tail"):
+        count = _constant(_argument(node, 0, "num_rows"))
+        return min(rows, count if isinstance(count, int) else rows), cost
+    if name == "slice":
+        start, stop = _constant(_argument(node, 0, "start")), _constant(_argument(node, 1, "stop"))
+        if isinstance(start, int) and isinstance(stop, int) and start >= 0 and stop >= 0:
+            return min(rows, max(stop - start, 0)), cost
+        return rows, cost
+    if name in ("head_pct", "tail_pct"):
+        pct = _constant(_argument(node, 0, "pct"))
+        return rows * (pct if isinstance(pct, (int, float)) else 1.0), cost
+    if name in ("head_by", "tail_by"):
+        count = _constant(_argument(node, 0, "num_rows"))
+        out = groups(_key_columns(_argument(node, 1, "by")), rows) * (count if isinstance(count, int) else 1)
+        return min(rows, out), cost + rows
+    if name in _AGGREGATION_METHODS:
+        if name == "select_distinct":
+            by = _argument(node, 0, "formulas")
+        elif name in ("count_by", "agg_by", "agg_all_by"):
+            by = _argument(node, 1, "by")
+        else:
+            by = _argument(node, 0, "by")
+        aggs = _argument(node, 0, "aggs") if name in ("agg_by", "agg_all_by") else None
+        ops = len(aggs[1]) if aggs is not None and aggs[0] == "list" else 1
+        return groups(_key_columns(by), rows) if by is not None else 1.0, cost + rows * ops
+    if name == "ungroup":
+        return rows * UNGROUP_FANOUT, cost + rows * UNGROUP_FANOUT
+
+    # joins
+    right = _argument(node, 0, "table")
+    if right is None or right[0] not in ("table", "call"):
+        return rows, cost + rows
+    right_rows, right_cost = estimate_cost(right, tables)
+    cost += right_cost
+    if name in ("natural_join", "exact_join"):
+        return rows, cost + rows + right_rows
+    if name in ("aj", "raj"):
+        return rows, cost + (rows + right_rows) * math.log2(right_rows + 2)
+    on = _argument(node, 1, "on")
+    matches = groups(_key_columns(on, left=False), right_rows) if on is not None else 1.0
+    out = rows * right_rows / max(matches, 1.0)
+    return out, cost + rows + right_rows + out
+
+
+def _evaluate(node: Tuple, tables: Dict[str, Table], deadline: Optional[float] = None) -> Any:
+    kind = node[0]
+    if kind == "table":
+        return tables[node[1]]
+    if kind == "const":
+        return node[1]
+    if kind == "list":
+        return [_evaluate(item, tables, deadline) for item in node[1]]
+    if kind == "agg":
+        _, name, args, kwargs = node
+        return getattr(agg, name)(*[_evaluate(arg, tables, deadline) for arg in args],
+                                  **{key: _evaluate(value, tables, deadline) for key, value in kwargs})
+
+    _, name, receiver, args, kwargs = node
+    receiver = _evaluate(receiver, tables, deadline)
+    args = [_evaluate(arg, tables, deadline) for arg in args]
+    kwargs = {key: _evaluate(value, tables, deadline) for key, value in kwargs}
+    # operations cannot be interrupted, so the deadline is checked between them
+    if deadline is not None and time.monotonic() > deadline:
+        raise QueryBudgetError(f"query ran out of time before {name}")
+    return getattr(receiver, name)(*args, **kwargs)
+
+
+class QueryEngine:
+    """Runs user queries, chains of whitelisted table operations, against a fixed set of named tables.
+
+    Queries never reach eval: they are parsed, checked against QUERY_METHODS and AGGREGATIONS, and run by
+    calling the operations directly. Their formula and filter strings are compiled by Deephaven's query
+    language, which is not sandboxed, so check_formulas holds them to methods on columns. This is a
+    whitelist over what the query language accepts, not an isolation boundary, and the engine should only
+    serve tables every user may read. Results are cached in a TableCache under the compiled query, so every
+    session running the same query, however it is formatted, shares one live table. Tables returned by run()
+    are handed back with release().
+    """
+
+    def __init__(self, tables: Dict[str, Table], cache: TableCache = TABLE_CACHE,
+                 budget: Optional[QueryBudget] = None):
+        self.tables = dict(tables)
+        self.cache = cache
+        self.budget = budget if budget is not None else QueryBudget()
+        self._columns = frozenset(column for table in self.tables.values() for column in table.column_names)
+        for table in self.tables.values():
+            count_cardinalities(table)
+
+    def compile(self, query: str) -> Tuple:
+        """Compiles query and checks that it only reads tables this engine knows about."""
+        node = compile_query(query)
+        unknown = sorted(query_tables(node) - self.tables.keys())
+        if unknown:
+            raise QueryError(f"unknown table {unknown[0]!r}, queries can use {', '.join(sorted(self.tables))}")
+        if node[0] != "table" and node[0] != "call":
+            raise QueryError("a query must evaluate to a table")
+        check_formulas(node, self._columns)
+        return node
+
+    def estimate(self, query: str) -> Tuple[float, float]:
+        """Returns the estimated row count and cost of query, see estimate_cost."""
+        return estimate_cost(self.compile(query), self.tables)
+
+    def run(self, query: str) -> Table:
+        """Returns the live table for query, from the cache if any session has run it before.
+
+        Queries estimated to cost more than the budget are refused before anything runs. A query that takes
+        longer than the budget's timeout is abandoned: the caller gets a QueryBudgetError, and the build stops
+        at its next operation and releases every table it had built. A build that only finishes after the
+        timeout is released as well rather than cached. At most max_rows rows are returned.
+        """
+        node = self.compile(query)
+        if node[0] == "table":
+            return self.tables[node[1]]
+
+        budget = self.budget
+        rows, cost = estimate_cost(node, self.tables)
+        if cost > budget.max_cost:
+            raise QueryBudgetError(f"query would touch about {cost:.3g} rows, over the budget of {budget.max_cost:.3g}")
+
+        sources = sorted(query_tables(node))
+        key = ("query", tuple((name, id(self.tables[name])) for name in sources), node, budget.max_rows)
+        deadline = time.monotonic() + budget.timeout
+
+        def build():
+            table = _evaluate(node, self.tables, deadline).head(budget.max_rows)
+            # the caller has given up on a build that finishes late, so it is not cached for the next one either
+            if time.monotonic() > deadline:
+                raise QueryBudgetError("query finished after its deadline")
+            return table
+
+        # built on a worker thread, so the caller can give up on it at the deadline
+        ctx = get_exec_ctx()
+        result = {}
+        lock = threading.Lock()
+
+        def work():
+            try:
+                with ctx:
+                    table = self.cache.acquire(key, [self.tables[name] for name in sources], build)
+            except Exception as e:
+                with lock:
+                    result["error"] = e
+                return
+            with lock:
+                if result.get("abandoned"):
+                    self.cache.release(table)
+                else:
+                    result["table"] = table
+
+        worker = threading.Thread(target=work, name="query", daemon=True)
+        worker.start()
+        worker.join(budget.timeout)
+
+        with lock:
+            if "table" in result:
+                return result["table"]
+            if "error" in result:
+                raise result["error"]
+            result["abandoned"] = True
+        raise QueryBudgetError(f"query did not finish within {budget.timeout:g} seconds")
+
+    def release(self, table: Table) -> None:
+        """Hands back a table returned by run()."""
+        self.cache.release(table)
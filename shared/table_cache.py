@@ -0,0 +1,178 @@
+from deephaven.liveness_scope import liveness_scope
+
+# other imports
+import datetime as dt
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence, Tuple, Union
+
+from deephaven.table import Table
+
+# quoted strings and date-time literals are left alone when normalizing whitespace in a filter
+_QUOTED = re.compile(r"(`[^`]*`|'[^']*')")
+
+
+def to_literal(value: Any) -> str:
+    """Renders a Python value as a Deephaven query language literal."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        # the literal has no escapes and becomes a Java string, so a backtick, double quote or backslash in value
+        # could end it and add query code
+        if any(char in value for char in "`\"\\"):
+            raise ValueError(f"cannot bind string {value!r} into a filter, it holds a quote or a backslash")
+        return f"`{value}`"
+    if isinstance(value, dt.datetime):
+        if value.tzinfo is None:
+            raise ValueError(f"cannot bind naive datetime {value!r} into a filter, give it a time zone")
+        return f"'{value.astimezone(dt.timezone.utc).replace(tzinfo=None).isoformat()}Z'"
+    if isinstance(value, dt.date):
+        return f"'{value.isoformat()}'"
+    raise TypeError(f"cannot bind {type(value).__name__} value {value!r} into a filter")
+
+
+def normalize_expression(expression: str) -> str:
+    """Collapses the whitespace of a query language expression, outside of its quoted literals."""
+    parts = _QUOTED.split(expression)
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts)).strip()
+
+
+def normalize_filters(filters: Union[str, Sequence[str]], params: Dict[str, Any]) -> Tuple[str, ...]:
+    """Binds params into the {name} placeholders of filters and collapses insignificant whitespace."""
+    if isinstance(filters, str):
+        filters = [filters]
+    literals = {name: to_literal(value) for name, value in params.items()}
+    return tuple(normalize_expression(f.format(**literals)) for f in filters)
+
+
+class _Entry:
+    def __init__(self, source: Table, table: Table, scope):
+        self.source = source
+        self.table = table
+        self.scope = scope
+        self.refs = 0
+
+
+class TableCache:
+    """An LRU cache of filtered tables, keyed by source table, normalized filters and bound parameters.
+
+    Every caller asking for the same selection gets the same table, which keeps a single set of listeners on
+    the update graph no matter how many sessions display it. Tables are reference counted: where() acquires a
+    reference, release() returns it, and only tables nobody holds are evicted once the cache is over capacity.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def where(self, source: Table, filters: Union[str, Sequence[str]], **params) -> Table:
+        """Returns source filtered by filters, with params bound into their {name} placeholders."""
+        key = (id(source), normalize_filters(filters, params))
+        return self.acquire(key, source, lambda: source.where(list(key[1])))
+
+    def acquire(self, key: Hashable, source: Any, build: Callable[[], Table]) -> Table:
+        """Returns the table cached under key, building it with build() if there is none.
+
+        source is whatever key identifies by id(), and is kept alive for as long as the table is cached. Tables
+        are built outside the cache lock, so a slow build only holds up the callers asking for the same key.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return self._acquire_entry(key, entry)
+
+        scope = liveness_scope()
+        try:
+            with scope.open():
+                table = build()
+        except Exception:
+            # nothing is cached for a build that fails, so let go of whatever it got to
+            scope.release()
+            raise
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # another caller built the same table in the meantime, keep theirs
+                scope.release()
+            else:
+                entry = _Entry(source, table, scope)
+                self._entries[key] = entry
+                self._keys[id(table)] = key
+            return self._acquire_entry(key, entry)
+
+    def release(self, table: Optional[Table]) -> None:
+        """Returns a reference to a table acquired from where(); the table stays cached until it is evicted."""
+        if table is None:
+            return
+        with self._lock:
+            key = self._keys.get(id(table))
+            if key is None:
+                return
+            entry = self._entries[key]
+            entry.refs = max(entry.refs - 1, 0)
+            self._evict()
+
+    def clear(self) -> None:
+        """Drops every table nobody holds a reference to."""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry.refs == 0]:
+                self._drop(key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self) -> None:
+        # oldest first, skipping tables that are still held
+        for key in [key for key, entry in self._entries.items() if entry.refs == 0]:
+            if len(self._entries) <= self.capacity:
+                break
+            self._drop(key)
+
+    def _drop(self, key) -> None:
+        entry = self._entries.pop(key)
+        del self._keys[id(entry.table)]
+        entry.scope.release()
+
+    def _acquire_entry(self, key, entry: _Entry) -> Table:
+        self._entries.move_to_end(key)
+        entry.refs += 1
+        self._evict()
+        return entry.table
+
+
+class TableLease:
+    """Holds one cached table per named slot on behalf of a single session.
+
+    Asking for a new selection in a slot releases the table the slot held before, so a session only ever
+    pins the tables it is currently showing.
+    """
+
+    def __init__(self, cache: TableCache):
+        self.cache = cache
+        self._tables = {}
+
+    def where(self, slot: str, source: Table, filters: Union[str, Sequence[str]], **params) -> Table:
+        """Returns the cached selection for slot, see TableCache.where."""
+        return self.hold(slot, self.cache.where(source, filters, **params))
+
+    def hold(self, slot: str, table: Table) -> Table:
+        """Holds table, already acquired from the cache, in slot and releases the table the slot held before."""
+        self.cache.release(self._tables.get(slot))
+        self._tables[slot] = table
+        return table
+
+    def release_all(self) -> None:
+        """Releases every table held by this lease."""
+        for table in self._tables.values():
+            self.cache.release(table)
+        self._tables.clear()
+
+
+# the cache shared by every session in this process
+TABLE_CACHE = TableCache()
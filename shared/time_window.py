@@ -0,0 +1,85 @@
+import deephaven.updateby as uby
+
+# other imports
+from datetime import timedelta
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from deephaven.table import Table
+
+
+def _nanos(d: timedelta) -> int:
+    return (d.days * 86400 + d.seconds) * 1_000_000_000 + d.microseconds * 1000
+
+
+def rolling_time_window(
+        table: Table,
+        ts_col: str,
+        value_col: str,
+        window: timedelta,
+        offset: timedelta = timedelta(seconds=0),
+        snap: Optional[timedelta] = None,
+        by: Union[str, Sequence[str], None] = None,
+        prefix: str = "") -> Table:
+    """Adds the open, high, low and close of value_col over a sliding time window to every row of table.
+
+    The window of a row covers the rows stamped between offset + window and offset before it. High and low
+    come from time-based update_by operators, which keep the rows of each window in a ring buffer, and open
+    and close come from as-of joins on the window bounds, so a new row costs work proportional to the rows
+    entering and leaving its window rather than a pass over the whole table. If snap is given, timestamps
+    are binned to snap first and the bin a row falls in is left out of its window, like an unfinished bar.
+    The result columns are named {prefix}Open, {prefix}High, {prefix}Low and {prefix}Close, and are computed
+    independently for every group of the by columns. All four are null for a row whose window is empty.
+    """
+    return rolling_time_windows(table, ts_col, value_col, {prefix: (window, offset)}, snap=snap, by=by)
+
+
+def rolling_time_windows(
+        table: Table,
+        ts_col: str,
+        value_col: str,
+        windows: Dict[str, Tuple[timedelta, timedelta]],
+        snap: Optional[timedelta] = None,
+        by: Union[str, Sequence[str], None] = None) -> Table:
+    """Adds the open, high, low and close of value_col over several sliding time windows at once.
+
+    windows maps a column prefix to the (window, offset) of that window, see rolling_time_window. The table is
+    sorted once and all highs and lows come out of a single update_by, so every extra window only adds its own
+    rolling operators and as-of joins.
+    """
+    by: List[str] = [by] if isinstance(by, str) else list(by or [])
+
+    if snap is not None:
+        snap_nanos = _nanos(snap)
+        table = table.update(f"WindowTime = lowerBin({ts_col}, snap_nanos)")
+    else:
+        table = table.update(f"WindowTime = {ts_col}")
+    # ties within a bin are ordered by time too, so the as-of joins take the earliest row as open and the latest as close
+    table = table.sort(by + ["WindowTime", ts_col])
+
+    bounds = {}
+    for prefix, (window, offset) in windows.items():
+        rev_nanos = _nanos(offset) + _nanos(window)
+        # with snap, only the bins before the current one
+        fwd_nanos = -(_nanos(offset) + 1) if snap is not None else -_nanos(offset)
+        bounds[prefix] = (rev_nanos, fwd_nanos)
+
+    result = table.\
+        update([formula
+                for prefix, (rev_nanos, fwd_nanos) in bounds.items()
+                for formula in (f"{prefix}WindowStart = WindowTime - {rev_nanos}L",
+                                f"{prefix}WindowEnd = WindowTime + {fwd_nanos}L")]).\
+        update_by([op
+                   for prefix, (rev_nanos, fwd_nanos) in bounds.items()
+                   for op in (uby.rolling_max_time("WindowTime", f"{prefix}High = {value_col}", rev_time=rev_nanos, fwd_time=fwd_nanos),
+                              uby.rolling_min_time("WindowTime", f"{prefix}Low = {value_col}", rev_time=rev_nanos, fwd_time=fwd_nanos))],
+                  by=by)
+
+    for prefix in windows:
+        result = result.\
+            raj(table, on=by + [f"{prefix}WindowStart <= WindowTime"], joins=f"{prefix}Open = {value_col}").\
+            aj(table, on=by + [f"{prefix}WindowEnd >= WindowTime"], joins=f"{prefix}Close = {value_col}").\
+            update([f"{prefix}Open = isNull({prefix}High) ? NULL_DOUBLE : (double){prefix}Open",
+                    f"{prefix}Close = isNull({prefix}High) ? NULL_DOUBLE : (double){prefix}Close"]).\
+            drop_columns([f"{prefix}WindowStart", f"{prefix}WindowEnd"])
+
+    return result.drop_columns("WindowTime")
@@ -0,0 +1,75 @@
+from deephaven.liveness_scope import liveness_scope
+from deephaven.update_graph import shared_lock
+
+# other imports
+from typing import Optional, Sequence, Tuple, Union
+
+import pandas as pd
+from deephaven.table import Table
+
+from .export import to_pandas
+from .table_cache import TABLE_CACHE, TableCache, TableLease, normalize_filters
+
+
+class TableViewport:
+    """Serves pages of a table to a single session, with the sorting and filtering done by Deephaven.
+
+    Only the rows of the requested page are converted to pandas, so a session holds on to one page at a time no
+    matter how large the table is. Filtered tables come from a TableCache shared with other sessions, and the
+    sorted table is rebuilt only when the sort or the filters change, not when paging through the same view.
+    """
+
+    def __init__(self, table: Table, cache: TableCache = TABLE_CACHE):
+        self.table = table
+        self._lease = TableLease(cache)
+        self._key = None
+        self._view = table
+        self._scope = None
+
+    def page(
+            self,
+            offset: int,
+            size: int,
+            sort_by: Optional[str] = None,
+            descending: bool = False,
+            filters: Union[str, Sequence[str]] = (),
+            **params) -> Tuple[pd.DataFrame, int]:
+        """Returns the size rows from offset of the sorted and filtered table, and the number of rows it has.
+
+        filters and params are given as for TableCache.where. The page is read in the same update graph cycle as
+        the row count, so the two agree on a ticking table. A page past the last row comes back empty.
+        """
+        key = (sort_by, descending, normalize_filters(filters, params))
+        if key != self._key:
+            self._rebuild(sort_by, descending, filters, params)
+            self._key = key
+
+        with shared_lock(self._view):
+            total = self._view.size
+            return to_pandas(self._view, rows=slice(offset, offset + size)), total
+
+    def close(self) -> None:
+        """Releases the tables held by this viewport."""
+        if self._scope is not None:
+            self._scope.release()
+            self._scope = None
+        self._lease.release_all()
+        self._key = None
+        self._view = self.table
+
+    def _rebuild(self, sort_by, descending, filters, params) -> None:
+        filters = [filters] if isinstance(filters, str) else list(filters)
+        view = self._lease.where("filtered", self.table, filters, **params) if filters else self.table
+
+        scope = None
+        if sort_by is not None:
+            scope = liveness_scope()
+            with scope.open():
+                view = view.sort_descending(sort_by) if descending else view.sort(sort_by)
+
+        if self._scope is not None:
+            self._scope.release()
+        if not filters:
+            self._lease.release_all()
+        self._scope = scope
+        self._view = view
@@ -2,160 +2,42 @@ from deephaven_server import Server
 s = Server(port=10000, jvm_args=["-Xmx4g",
                                        "-DAuthHandlers=io.deephaven.auth.AnonymousAuthenticationHandler",
                                        "-Dprocess.info.system-info.enabled=false"])
-# for analysis
-from deephaven import read_csv
-import deephaven.agg as agg
-import deephaven.updateby as uby
+s.start()
 
-import deephaven.time as dhtu
+# for analysis
+import sys
+import threading
 import deephaven.pandas as dhpd
+from deephaven.table import Table
 
 # other imports
-import datetime as dt
 import shinyswatch
 
-def create_tables():
-
-    stations = read_csv("../data/static/austin_bikeshare_stations.csv")
-    trips = read_csv("../data/static/austin_bikeshare_trips.csv")
-
-    # drop unwanted columns, filter rows, change types
-    stations = stations.drop_columns("location")
-    trips = trips.\
-        drop_columns(["month", "year", "checkout_time", "end_station_name", "start_station_name"]).\
-        update(["bikeid = (int)bikeid",
-                "end_station_id = (int)end_station_id",
-                "start_station_id = (int)start_station_id"]).\
-        where(["!isNull(end_station_id)",
-               "!isNull(start_station_id)"]).\
-        update("start_time = parseInstant(start_time.replace(` `, `T`).concat(` CT`))")
-
-    # aggregate subscriber_type into fewer categories and eliminate subscriber types with fewer than 100 subs
-    trips = trips.\
-        where("!isNull(subscriber_type)").\
-        update(["subscriber_type = subscriber_type.contains(`24`) ? `24-Hour Vendor` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`RideScout`) ? `24-Hour Vendor` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`Republic`) ? `24-Hour Vendor` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`Annual`) ? `Annual Membership` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`Local365`) ? `Annual Membership` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`Semester`) ? `Semester Membership` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`Local30`) ? `30-Day Membership` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`7-Day`) ? `7-Day Membership` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`Weekender`) ? `Weekend Membership` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`Explorer`) ? `1-Day Membership` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`Founding`) ? `Founding Member` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`Try Before`) ? `Trial Membership` : subscriber_type",
-                "subscriber_type = subscriber_type.contains(`ACL`) ? `ACL` : subscriber_type"])
-
-    trips = trips.\
-        join(trips.count_by("sub_count", by = "subscriber_type"), on = "subscriber_type", joins = "sub_count").\
-        where("sub_count >= 100").\
-        drop_columns("sub_count")
-
-
-    ### Frequency analysis
-
-    # hourly and daily trip count
-    hourly_ride_freq = trips.\
-        update(["hour = hourOfDay(start_time, 'CT')",
-                "hour = hour == 24 ? 23 : hour",
-                "timestamp = toInstant(toLocalDate(start_time, 'CT'), millisOfDayToLocalTime((hour * 60 * 60 * 1000)), 'CT')"]).\
-        count_by("trip_count", by = "timestamp").\
-        sort("timestamp").\
-        update(["day = dayOfYear(timestamp, 'CT')",
-                "month = monthOfYear(timestamp, 'CT')",
-                "year = year(timestamp, 'CT')"])
-
-    hourly_ride_freq_by_day = hourly_ride_freq.\
-        agg_by([agg.avg("avg_by_day = trip_count"),
-                agg.std("std_by_day = trip_count")], by = ["day", "month", "year"])
-
-    hourly_ride_freq_by_month = hourly_ride_freq.\
-        agg_by([agg.avg("avg_by_month = trip_count"),
-                agg.std("std_by_month = trip_count")], by = ["month", "year"])
-
-    hourly_ride_freq_by_year = hourly_ride_freq.\
-        agg_by([agg.avg("avg_by_year = trip_count"),
-                agg.std("std_by_year = trip_count")], by = "year")
-
-    hourly_ride_freq_stats = hourly_ride_freq_by_day.\
-        join(hourly_ride_freq_by_month, on = ["month", "year"], joins = ["avg_by_month", "std_by_month"]).\
-        join(hourly_ride_freq_by_year, on = "year", joins = ["avg_by_year", "std_by_year"])
-
-
-    daily_ride_freq = hourly_ride_freq.\
-        update("timestamp = atMidnight(timestamp, 'CT')").\
-        agg_by([agg.sum_("trip_count"), agg.first(["day", "month", "year"])], by = "timestamp")
-
-    daily_ride_freq_by_month = daily_ride_freq.\
-        agg_by([agg.avg("avg_by_month = trip_count"),
-                agg.std("std_by_month = trip_count")], by = ["month", "year"])
-
-    daily_ride_freq_by_year = daily_ride_freq.\
-        agg_by([agg.avg("avg_by_year = trip_count"),
-                agg.std("std_by_year = trip_count")], by = "year")
-
-    daily_ride_freq_stats = daily_ride_freq_by_month.\
-        join(daily_ride_freq_by_year, on = "year", joins = ["avg_by_year", "std_by_year"])
+# make the shared pipeline package importable
+sys.path.append("..")
+from shared.bikeshare import get_tables
+from shared.query import QueryEngine, check_formula
+from shared.table_cache import TABLE_CACHE, TableLease
+from shared.viewport import TableViewport
 
+def create_tables():
+    # built once per process by the first session to connect, every later session attaches to the same tables
+    tables = get_tables("../data/static")
 
-    # hourly trip rolling average and standardization
-    hourly_ride_freq_avg = hourly_ride_freq.\
-        update_by(uby.rolling_avg_tick("trip_count_avg = trip_count", rev_ticks = 24, fwd_ticks = 24)).\
-        join(hourly_ride_freq_stats.first_by(["month", "year"]), on = ["month", "year"], joins = ["avg_by_month", "std_by_month"]).\
-        update("standardized_trip_count = (trip_count - avg_by_month) / std_by_month").\
-        update_by(uby.rolling_avg_tick("standardized_trip_count_avg = standardized_trip_count", rev_ticks = 12, fwd_ticks = 12), by = ["month", "year"])
-
-    # daily trip count rolling average and standardization
-    daily_ride_freq_avg = daily_ride_freq.\
-        update_by(uby.rolling_avg_tick("trip_count_avg = trip_count", rev_ticks = 15, fwd_ticks = 15)).\
-        where(["year > 2013", "year < 2017"]).\
-        join(daily_ride_freq_stats.first_by("year"), on = "year", joins = ["avg_by_year", "std_by_year"]).\
-        update("standardized_trip_count = (trip_count - avg_by_year) / std_by_year").\
-        update_by(uby.rolling_avg_tick("standardized_trip_count_avg = standardized_trip_count", rev_ticks = 15, fwd_ticks = 15), by = "year")
-
-
-    ### Duration analysis
-
-    hourly_ride_dur = trips.\
-        update(["hour = hourOfDay(start_time, 'CT')",
-                "hour = hour == 24 ? 23 : hour",
-                "timestamp = toInstant(toLocalDate(start_time, 'CT'), millisOfDayToLocalTime((hour * 60 * 60 * 1000)), 'CT')"]).\
-        agg_by([agg.sum_("duration_sum = duration_minutes"),
-                agg.avg("duration_avg = duration_minutes"),
-                agg.median("duration_med = duration_minutes")], by = "timestamp").\
-        sort("timestamp").\
-        update(["day = dayOfYear(timestamp, 'CT')",
-                "month = monthOfYear(timestamp, 'CT')",
-                "year = year(timestamp, 'CT')"])
-
-    hourly_ride_dur_avg = hourly_ride_dur.\
-        update_by(uby.rolling_avg_time("timestamp",
-            ["duration_avg_sum = duration_sum",
-             "duration_avg_avg = duration_avg",
-             "duration_avg_med = duration_med"],
-            rev_time = "PT24h", fwd_time = "PT24h"))
-
-    daily_ride_dur = trips.\
-        update(["timestamp = atMidnight(start_time, 'CT')"]).\
-        agg_by([agg.sum_("duration_sum = duration_minutes"),
-                agg.avg("duration_avg = duration_minutes"),
-                agg.median("duration_med = duration_minutes")], by = "timestamp").\
-        sort("timestamp").\
-        update(["day = dayOfYear(timestamp, 'CT')",
-                "month = monthOfYear(timestamp, 'CT')",
-                "year = year(timestamp, 'CT')"])
+    return tables["stations"], tables["trips"], \
+        tables["hourly_ride_freq"], tables["hourly_ride_freq_avg"], tables["daily_ride_freq"], \
+        tables["daily_ride_freq_stats"], tables["daily_ride_freq_avg"], \
+        tables["hourly_ride_dur"], tables["hourly_ride_dur_avg"], tables["daily_ride_dur"], tables["daily_ride_dur_avg"]
 
-    daily_ride_dur_avg = daily_ride_dur.\
-        update_by(uby.rolling_avg_time("timestamp",
-            ["duration_avg_sum = duration_sum",
-             "duration_avg_avg = duration_avg",
-             "duration_avg_med = duration_med"],
-            rev_time = "P15D", fwd_time = "P15D"))
+# pandas copies shared by every session, converted by the first session that needs them
+_FRAMES = {}
+_FRAMES_LOCK = threading.Lock()
 
-    return stations, trips, \
-        hourly_ride_freq, hourly_ride_freq_avg, daily_ride_freq, daily_ride_freq_stats, daily_ride_freq_avg, \
-        hourly_ride_dur, hourly_ride_dur_avg, daily_ride_dur, daily_ride_dur_avg
+def shared_frame(name, table):
+    with _FRAMES_LOCK:
+        if name not in _FRAMES:
+            _FRAMES[name] = dhpd.to_pandas(table)
+        return _FRAMES[name]
 
 
 ############################################################ APP #######################################################
@@ -174,6 +56,23 @@ app_ui = ui.page_fluid(
                 ui.column(6,
                     "trips dataset",
                     ui.card(
+                        ui.row(
+                            ui.column(4,
+                                ui.input_select("trips_sort", "Sort by", choices=["None"], selected="None")
+                            ),
+                            ui.column(2,
+                                ui.input_checkbox("trips_descending", "Descending", value=False)
+                            ),
+                            ui.column(3,
+                                ui.input_numeric("trips_page", "Page", value=1, min=1)
+                            ),
+                            ui.column(3,
+                                ui.input_select("trips_page_size", "Rows per page",
+                                                choices=["25", "50", "100", "250"], selected="100")
+                            )
+                        ),
+                        ui.input_text("trips_filter", "Filter, e.g. subscriber_type == `Walk Up`", width='100%'),
+                        ui.output_text("trips_page_info"),
                         ui.output_data_frame("trips_dataset")
                     )
                 ),
@@ -292,14 +191,47 @@ def server(input, output, session):
         hourly_ride_freq, hourly_ride_freq_avg, daily_ride_freq, daily_ride_freq_stats, daily_ride_freq_avg, \
         hourly_ride_dur, hourly_ride_dur_avg, daily_ride_dur, daily_ride_dur_avg = create_tables()
 
-    trips_df = dhpd.to_pandas(trips)
-    stations_df = dhpd.to_pandas(stations)
+    stations_df = shared_frame("stations", stations)
+
+    # per-session state is limited to the views this session derives from the shared tables
+    # only the page on screen is converted, sorting and filtering happen in Deephaven
+    trips_viewport = TableViewport(trips)
+    session.on_ended(trips_viewport.close)
+    ui.update_select("trips_sort", choices=["None"] + trips.column_names, selected="None")
+
+    @reactive.Calc
+    def trips_page():
+        size = int(input.trips_page_size())
+        offset = (max(input.trips_page() or 1, 1) - 1) * size
+        sort_by = None if input.trips_sort() == "None" else input.trips_sort()
+        filters = [input.trips_filter()] if input.trips_filter().strip() else []
+        try:
+            # the filter is compiled by the query language, so it is held to methods on the trips columns
+            for trips_filter in filters:
+                check_formula(trips_filter, trips.column_names)
+            page, total = trips_viewport.page(offset, size, sort_by, input.trips_descending(), filters)
+        except Exception as e:
+            # a filter that is refused or does not parse leaves the grid empty rather than failing the session
+            return dhpd.to_pandas(trips.head(0)), 0, offset, str(e)
+        return page, total, offset, None
+
+    @output
+    @render.text
+    def trips_page_info():
+        page, total, offset, error = trips_page()
+        if error is not None:
+            return f"Invalid filter: {error}"
+        if total == 0:
+            return "No matching trips"
+        if len(page) == 0:
+            return f"Past the last page, there are {total} rows"
+        return f"Rows {offset + 1}-{offset + len(page)} of {total}"
 
     @output
     @render.data_frame
     def trips_dataset():
         return render.DataGrid(
-            trips_df,
+            trips_page()[0],
             row_selection_mode="multiple",
             width=773,
             height=607,
@@ -315,9 +247,16 @@ def server(input, output, session):
             height=607,
         )
 
+    # user queries are chains of whitelisted table operations on the shared tables, with formulas held to methods
+    # on columns by shared.query.check_formulas; results are shared by all sessions
+    query_engine = QueryEngine({name: table for name, table in get_tables("../data/static").items()
+                                if isinstance(table, Table)})
+    query_lease = TableLease(TABLE_CACHE)
+    session.on_ended(query_lease.release_all)
+
     @reactive.Calc
     def create_queried_dataset():
-        return dhpd.to_pandas(eval(input.data_query()))
+        return dhpd.to_pandas(query_lease.hold("data_query", query_engine.run(input.data_query())))
 
     @output
     @render.data_frame
@@ -1,14 +1,21 @@
 import backend
 import streamlit as st
 
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit_deephaven import display_dh
 import deephaven.agg as agg
-import deephaven.updateby as uby
-import deephaven.time as dhtu
-import deephaven.pandas as dhpd
 from deephaven.plot.figure import Figure
+from deephaven.table import Table
+
+from shared.export import to_pandas
+from shared.figures import FigureTables
+from shared.live_cache import LIVE_CACHE, live_cache
+from shared.map_payload import PointPayload
+from shared.query import QueryEngine, QueryError
+from shared.table_cache import TABLE_CACHE, TableLease
 
 import datetime as dt
+import weakref
 
 ############ APP FRONTEND ############
 
@@ -16,15 +23,28 @@ st.set_page_config(layout="wide")
 
 CTX, tables = backend.create_tables()
 
-# append tables to the streamlit session_state, in hopes that persisting tables through changes helps performance
-if len(st.session_state) == 0:
-    for var_name, var in tables.items():
-        st.session_state[var_name] = var
+# filtered tables come from a cache shared by all sessions, this session only holds on to the ones it shows,
+# and likewise for the figures built by the live_cache functions below, which are only evicted once no session
+# shows them
+if "table_lease" not in st.session_state:
+    st.session_state.table_lease = TableLease(TABLE_CACHE)
+    st.session_state.figure_lease = TableLease(LIVE_CACHE)
+    # streamlit has no hook for a session ending, but its session state is dropped along with it, which hands
+    # back everything the session held
+    weakref.finalize(get_script_run_ctx().session_state, st.session_state.table_lease.release_all)
+    weakref.finalize(get_script_run_ctx().session_state, st.session_state.figure_lease.release_all)
+
+# user queries are chains of whitelisted table operations on the shared tables, with formulas held to methods
+# on columns by shared.query.check_formulas; the engine is built once and its results are shared by all sessions
+@st.cache_resource
+def query_engine():
+    with CTX:
+        return QueryEngine({name: table for name, table in tables.items() if isinstance(table, Table)})
 
 MIN_DATE = dt.date(2013, 12, 22)
 MAX_DATE = dt.date(2017, 8, 1)
 
-available_months_df = dhpd.to_pandas(st.session_state.daily_ride_freq_stats)
+available_months_df = to_pandas(tables["daily_ride_freq_stats"], cols=["year", "month"])
 AVAILABLE_MONTHS = {year: list(available_months_df.loc[available_months_df["year"] == year]["month"])
                     for year in (2013, 2014, 2015, 2016, 2017)}
 
@@ -44,18 +64,204 @@ with data_tab:
     data_c1, data_c2 = st.columns(2)
     with data_c1:
         st.write("_trips_ dataset")
-        display_dh(st.session_state.trips)
+        display_dh(tables["trips"])
     with data_c2:
         st.write("_stations_ dataset")
-        display_dh(st.session_state.stations)
+        display_dh(tables["stations"])
 
     st.write("Input your own Deephaven query here!")
     st.text_input("This only supports single-expression queries.",
                   "trips.update(\"month = monthOfYear(start_time, 'CT')\").where(\"month == 3\")",
                   key = "data_query")
-    with CTX:
-        custom_query_table = eval("st.session_state." + st.session_state.data_query)
-    display_dh(custom_query_table)
+    try:
+        with CTX:
+            custom_query_table = st.session_state.table_lease.hold("data_query",
+                                                                   query_engine().run(st.session_state.data_query))
+        display_dh(custom_query_table)
+    except QueryError as e:
+        st.error(str(e))
+    except Exception as e:
+        st.error(f"query failed: {e}")
+
+############ CACHED FIGURES ############
+
+# figures are built once per distinct selection and shared by every session and rerun, see shared.live_cache;
+# a session holds each one it shows in a slot of its figure lease
+
+@live_cache
+def daily_plot(table, title, stat_column, rolling_stat_column, start, end):
+    # both series plot the same date range, so they share one filtered table
+    figure_tables = FigureTables()
+    return Figure().\
+        plot_xy(series_name=title,
+                t=figure_tables.where(table,
+                                      ["toLocalDate(timestamp, 'CT') >= {start}",
+                                       "toLocalDate(timestamp, 'CT') <= {end}"],
+                                      start=start,
+                                      end=end),
+                x="timestamp",
+                y=stat_column).\
+        plot_xy(series_name="30-day rolling average",
+                t=figure_tables.where(table,
+                                      ["toLocalDate(timestamp, 'CT') >= {start}",
+                                       "toLocalDate(timestamp, 'CT') <= {end}"],
+                                      start=start,
+                                      end=end),
+                x="timestamp",
+                y=rolling_stat_column).\
+        show()
+
+def month_table(by_month, table, year, month):
+    # the data only covers some (year, month) pairs, and in streaming mode a month has no constituent until its
+    # first trip ticks in, so fall back to filtering table, which is empty until then instead of None
+    constituent = by_month.get_constituent([year, month])
+    return constituent if constituent is not None else table.where([f"year == {year}", f"month == {month}"])
+
+@live_cache
+def hourly_plot(table_by_month, table, title, stat_column, rolling_stat_column, year, month):
+    month_data = month_table(table_by_month, table, year, month)
+    return Figure(). \
+        plot_xy(series_name=title,
+                t=month_data,
+                x="timestamp",
+                y=stat_column). \
+        plot_xy(series_name="24-hour rolling average",
+                t=month_data,
+                x="timestamp",
+                y=rolling_stat_column). \
+        show()
+
+@live_cache
+def time_q1_plot(trips):
+    return Figure(). \
+        plot_pie(series_name="Ride Frequency by Subscription Type",
+                 t=trips.count_by("count", by="subscriber_type"),
+                 category="subscriber_type",
+                 y="count"). \
+        show()
+
+@live_cache
+def time_q2_plot(daily_ride_freq_avg):
+    return Figure(). \
+        plot_xy(series_name="Year-standardized trip count in 2014",
+                t=daily_ride_freq_avg.where("year == 2014").update("day_of_year = dayOfYear(timestamp, 'CT')"),
+                x="day_of_year",
+                y="standardized_trip_count_avg"). \
+        plot_xy(series_name="Year-standardized trip count in 2015",
+                t=daily_ride_freq_avg.where("year == 2015").update("day_of_year = dayOfYear(timestamp, 'CT')"),
+                x="day_of_year",
+                y="standardized_trip_count_avg"). \
+        plot_xy(series_name="Year-standardized trip count in 2016",
+                t=daily_ride_freq_avg.where("year == 2016").update("day_of_year = dayOfYear(timestamp, 'CT')"),
+                x="day_of_year",
+                y="standardized_trip_count_avg"). \
+        show()
+
+@live_cache
+def time_q3_plot(hourly_ride_freq_avg_by_month, hourly_ride_freq_avg, month):
+    return Figure(rows=1, cols=3). \
+        new_chart(row=0, col=0). \
+        plot_xy(series_name="2014",
+                t=month_table(hourly_ride_freq_avg_by_month, hourly_ride_freq_avg, 2014, month),
+                x="timestamp",
+                y="standardized_trip_count_avg"). \
+        new_chart(row=0, col=1). \
+        plot_xy(series_name="2015",
+                t=month_table(hourly_ride_freq_avg_by_month, hourly_ride_freq_avg, 2015, month),
+                x="timestamp",
+                y="standardized_trip_count_avg"). \
+        new_chart(row=0, col=2). \
+        plot_xy(series_name="2016",
+                t=month_table(hourly_ride_freq_avg_by_month, hourly_ride_freq_avg, 2016, month),
+                x="timestamp",
+                y="standardized_trip_count_avg"). \
+        show()
+
+@live_cache
+def time_q4_plot(daily_ride_freq):
+    return Figure() \
+        .plot_cat(series_name="2013",
+                  t=daily_ride_freq.where("year == 2013").agg_by(agg.sum_("trip_count"), by="month"),
+                  category="month", y="trip_count") \
+        .plot_cat(series_name="2014",
+                  t=daily_ride_freq.where("year == 2014").agg_by(agg.sum_("trip_count"), by="month"),
+                  category="month", y="trip_count") \
+        .plot_cat(series_name="2015",
+                  t=daily_ride_freq.where("year == 2015").agg_by(agg.sum_("trip_count"), by="month"),
+                  category="month", y="trip_count") \
+        .plot_cat(series_name="2016",
+                  t=daily_ride_freq.where("year == 2016").agg_by(agg.sum_("trip_count"), by="month"),
+                  category="month", y="trip_count") \
+        .plot_cat(series_name="2017",
+                  t=daily_ride_freq.where("year == 2017").agg_by(agg.sum_("trip_count"), by="month"),
+                  category="month", y="trip_count") \
+        .show()
+
+@live_cache
+def time_q5_plot(trips):
+    return Figure(rows=2, cols=1). \
+        new_chart(row=0, col=0). \
+        plot_xy_hist(series_name="Annual subscribers",
+                     t=trips.where("subscriber_type == `Annual Membership`"),
+                     x="duration_minutes",
+                     nbins=50,
+                     xmin=0.0,
+                     xmax=100.0). \
+        new_chart(row=1, col=0). \
+        plot_xy_hist(series_name="Non-annual subscribers",
+                     t=trips.where("subscriber_type != `Annual Membership`"),
+                     x="duration_minutes",
+                     nbins=50,
+                     xmin=0.0,
+                     xmax=100.0). \
+        show()
+
+@live_cache
+def time_q6_plot(trips):
+    return Figure(). \
+        plot_pie(series_name="Long Rides by Subscription Type",
+                 t=trips.where("duration_minutes > 500").count_by("count", by="subscriber_type"),
+                 category="subscriber_type",
+                 y="count"). \
+        show()
+
+@live_cache
+def time_q7_plot(trips):
+    day_of_week_name_array = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    time_q7_table = trips. \
+        update(["day_of_week = dayOfWeek(start_time, 'CT')", ]). \
+        agg_by([agg.avg("duration_avg = duration_minutes"),
+                agg.median("duration_med = duration_minutes")], by="day_of_week"). \
+        sort("day_of_week"). \
+        update("day_of_week_name = (String)day_of_week_name_array[i]")
+
+    return Figure(). \
+        plot_cat(series_name="Average ride duration", t=time_q7_table, category="day_of_week_name",
+                 y="duration_avg"). \
+        plot_cat(series_name="Median ride duration", t=time_q7_table, category="day_of_week_name",
+                 y="duration_med"). \
+        show()
+
+@live_cache
+def time_q8_table(trips):
+    return trips. \
+        update(["day_of_week = dayOfWeek(start_time, 'CT')",
+                "minute_of_day = minuteOfDay(start_time, 'CT')"]). \
+        agg_by(agg.median("duration_minutes"), by=["minute_of_day", "day_of_week"]). \
+        sort("minute_of_day")
+
+@live_cache
+def time_q8_plot(q8_table, day_of_week):
+    return Figure(). \
+        plot_xy(series_name="Median intraday ride duration",
+                t=q8_table.where(f"day_of_week == {day_of_week}"),
+                x="minute_of_day",
+                y="duration_minutes"). \
+        show()
+
+DURATION_STATS = {"Sum": ("sum of ride durations in minutes", "duration_sum", "duration_avg_sum"),
+                  "Average": ("average ride duration in minutes", "duration_avg", "duration_avg_avg"),
+                  "Median": ("median ride duration in minutes", "duration_med", "duration_avg_med")}
 
 with time_tab:
     time_c1, time_c2 = st.columns(2)
@@ -71,22 +277,10 @@ with time_tab:
                 max_value = MAX_DATE,
                 key="freq_date_window"
             )
-            primary_frequency_plot_start_j = dhtu.to_j_local_date(primary_frequency_plot_start)
-            primary_frequency_plot_end_j = dhtu.to_j_local_date(primary_frequency_plot_end)
             with CTX:
-                daily_frequency_plot = Figure().\
-                    plot_xy(series_name="Daily ride count",
-                            t=st.session_state.daily_ride_freq_avg.where(["toLocalDate(timestamp, 'CT') >= primary_frequency_plot_start_j",
-                                                         "toLocalDate(timestamp, 'CT') <= primary_frequency_plot_end_j"]),
-                            x="timestamp",
-                            y="trip_count").\
-                    plot_xy(series_name="30-day rolling average",
-                            t=st.session_state.daily_ride_freq_avg.where(["toLocalDate(timestamp, 'CT') >= primary_frequency_plot_start_j",
-                                                         "toLocalDate(timestamp, 'CT') <= primary_frequency_plot_end_j"]),
-                            x="timestamp",
-                            y="trip_count_avg").\
-                    show()
-            display_dh(daily_frequency_plot)
+                daily_frequency_plot = daily_plot(tables["daily_ride_freq_avg"], "Daily ride count", "trip_count",
+                                                  "trip_count_avg", primary_frequency_plot_start, primary_frequency_plot_end)
+            display_dh(st.session_state.figure_lease.hold("daily_frequency_plot", daily_frequency_plot))
 
         with hourly_count_tab:
             hourly_count_tab_c1, hourly_count_tab_c2 = st.columns(2)
@@ -95,19 +289,10 @@ with time_tab:
             with hourly_count_tab_c2:
                 st.selectbox("Select a month.", [MONTH_INT_TO_STR[month] for month in AVAILABLE_MONTHS[st.session_state.freq_year]], key = "freq_month")
             with CTX:
-                hourly_frequency_plot = Figure(). \
-                    plot_xy(series_name="Hourly ride count",
-                            t=st.session_state.hourly_ride_freq_avg.where(["year == (int)st.session_state.freq_year",
-                                                          "month == (int)MONTH_STR_TO_INT[st.session_state.freq_month]"]),
-                            x="timestamp",
-                            y="trip_count"). \
-                    plot_xy(series_name="24-hour rolling average",
-                            t=st.session_state.hourly_ride_freq_avg.where(["year == (int)st.session_state.freq_year",
-                                                          "month == (int)MONTH_STR_TO_INT[st.session_state.freq_month]"]),
-                            x="timestamp",
-                            y="trip_count_avg"). \
-                    show()
-            display_dh(hourly_frequency_plot)
+                hourly_frequency_plot = hourly_plot(tables["hourly_ride_freq_avg_by_month"], tables["hourly_ride_freq_avg"],
+                                                    "Hourly ride count", "trip_count", "trip_count_avg", st.session_state.freq_year,
+                                                    MONTH_STR_TO_INT[st.session_state.freq_month])
+            display_dh(st.session_state.figure_lease.hold("hourly_frequency_plot", hourly_frequency_plot))
 
         with daily_duration_tab:
             primary_duration_plot_start, primary_duration_plot_end = st.date_input(
@@ -118,28 +303,11 @@ with time_tab:
                 key = "dur_date_window"
             )
             st.radio("Select a statistic of interest.", ("Sum", "Average", "Median"), key="daily_dur_stat", horizontal=True)
-            if st.session_state.daily_dur_stat == "Sum":
-                daily_title, daily_stat_column, daily_rolling_stat_column = ("Daily sum of ride durations in minutes", "duration_sum", "duration_avg_sum")
-            elif st.session_state.daily_dur_stat == "Average":
-                daily_title, daily_stat_column, daily_rolling_stat_column = ("Daily average ride duration in minutes", "duration_avg", "duration_avg_avg")
-            elif st.session_state.daily_dur_stat == "Median":
-                daily_title, daily_stat_column, daily_rolling_stat_column = ("Daily median ride duration in minutes", "duration_med", "duration_avg_med")
-            primary_duration_plot_start_j = dhtu.to_j_local_date(primary_duration_plot_start)
-            primary_duration_plot_end_j = dhtu.to_j_local_date(primary_duration_plot_end)
+            daily_title, daily_stat_column, daily_rolling_stat_column = DURATION_STATS[st.session_state.daily_dur_stat]
             with CTX:
-                daily_duration_plot = Figure().\
-                    plot_xy(series_name=daily_title,
-                            t=st.session_state.daily_ride_dur_avg.where(["toLocalDate(timestamp, 'CT') >= primary_duration_plot_start_j",
-                                                         "toLocalDate(timestamp, 'CT') <= primary_duration_plot_end_j"]),
-                            x="timestamp",
-                            y=daily_stat_column).\
-                    plot_xy(series_name="30-day rolling average",
-                            t=st.session_state.daily_ride_dur_avg.where(["toLocalDate(timestamp, 'CT') >= primary_duration_plot_start_j",
-                                                         "toLocalDate(timestamp, 'CT') <= primary_duration_plot_end_j"]),
-                            x="timestamp",
-                            y=daily_rolling_stat_column).\
-                    show()
-            display_dh(daily_duration_plot)
+                daily_duration_plot = daily_plot(tables["daily_ride_dur_avg"], "Daily " + daily_title, daily_stat_column,
+                                                 daily_rolling_stat_column, primary_duration_plot_start, primary_duration_plot_end)
+            display_dh(st.session_state.figure_lease.hold("daily_duration_plot", daily_duration_plot))
 
         with hourly_duration_tab:
             hourly_duration_c1, hourly_duration_c2 = st.columns(2)
@@ -148,26 +316,13 @@ with time_tab:
             with hourly_duration_c2:
                 st.selectbox("Select a month.", [MONTH_INT_TO_STR[month] for month in AVAILABLE_MONTHS[st.session_state.dur_year]], key = "dur_month")
             st.radio("Select a statistic of interest.", ("Sum", "Average", "Median"), key="hourly_dur_stat", horizontal=True)
-            if st.session_state.hourly_dur_stat == "Sum":
-                hourly_title, hourly_stat_column, hourly_rolling_stat_column = ("Daily sum of ride durations in minutes", "duration_sum", "duration_avg_sum")
-            elif st.session_state.hourly_dur_stat == "Average":
-                hourly_title, hourly_stat_column, hourly_rolling_stat_column = ("Daily average ride duration in minutes", "duration_avg", "duration_avg_avg")
-            elif st.session_state.hourly_dur_stat == "Median":
-                hourly_title, hourly_stat_column, hourly_rolling_stat_column = ("Daily median ride duration in minutes", "duration_med", "duration_avg_med")
+            hourly_title, hourly_stat_column, hourly_rolling_stat_column = DURATION_STATS[st.session_state.hourly_dur_stat]
             with CTX:
-                hourly_duration_plot = Figure(). \
-                    plot_xy(series_name=hourly_title,
-                            t=st.session_state.hourly_ride_dur_avg.where(["year == (int)st.session_state.dur_year",
-                                                          "month == (int)MONTH_STR_TO_INT[st.session_state.dur_month]"]),
-                            x="timestamp",
-                            y=hourly_stat_column). \
-                    plot_xy(series_name="24-hour rolling average",
-                            t=st.session_state.hourly_ride_dur_avg.where(["year == (int)st.session_state.dur_year",
-                                                          "month == (int)MONTH_STR_TO_INT[st.session_state.dur_month]"]),
-                            x="timestamp",
-                            y=hourly_rolling_stat_column). \
-                    show()
-            display_dh(hourly_duration_plot)
+                hourly_duration_plot = hourly_plot(tables["hourly_ride_dur_avg_by_month"], tables["hourly_ride_dur_avg"],
+                                                   "Daily " + hourly_title,
+                                                   hourly_stat_column, hourly_rolling_stat_column, st.session_state.dur_year,
+                                                   MONTH_STR_TO_INT[st.session_state.dur_month])
+            display_dh(st.session_state.figure_lease.hold("hourly_duration_plot", hourly_duration_plot))
 
     with time_c2:
         st.write("Some interesting research questions...")
@@ -176,160 +331,72 @@ with time_tab:
             st.write("This plot shows how often users of each subscription types go for a ride. Note that the various \
                      subscription types have been aggregated into these 11 primary categories for simplicity.")
             with CTX:
-                time_q1_plot = Figure(). \
-                    plot_pie(series_name="Ride Frequency by Subscription Type",
-                             t=st.session_state.trips.count_by("count", by="subscriber_type"),
-                             category="subscriber_type",
-                             y="count"). \
-                    show()
-            display_dh(time_q1_plot)
+                display_dh(st.session_state.figure_lease.hold("time_q1_plot", time_q1_plot(tables["trips"])))
 
         with st.expander("How does overall ride count trend compare from year to year?"):
             st.write("This plot shows trends from all three complete years. The differences in magnitude \
                      and variation have been removed to make the trend comparison as simple as possible.")
             with CTX:
-                time_q2_plot = Figure(). \
-                    plot_xy(series_name="Year-standardized trip count in 2014",
-                            t=st.session_state.daily_ride_freq_avg.where("year == 2014").update("day_of_year = dayOfYear(timestamp, 'CT')"),
-                            x="day_of_year",
-                            y="standardized_trip_count_avg"). \
-                    plot_xy(series_name="Year-standardized trip count in 2015",
-                            t=st.session_state.daily_ride_freq_avg.where("year == 2015").update("day_of_year = dayOfYear(timestamp, 'CT')"),
-                            x="day_of_year",
-                            y="standardized_trip_count_avg"). \
-                    plot_xy(series_name="Year-standardized trip count in 2016",
-                            t=st.session_state.daily_ride_freq_avg.where("year == 2016").update("day_of_year = dayOfYear(timestamp, 'CT')"),
-                            x="day_of_year",
-                            y="standardized_trip_count_avg"). \
-                    show()
-            display_dh(time_q2_plot)
+                display_dh(st.session_state.figure_lease.hold("time_q2_plot", time_q2_plot(tables["daily_ride_freq_avg"])))
 
         with st.expander("Do the same months exhibit similar ride count trends from year to year?"):
             st.write("This plot shows trends from the selected month from all three complete years. The differences \
                      in magnitude and variation have been removed to make the trend comparison as simple as possible.")
             st.selectbox("Select a month.", (MONTH_STR_TO_INT.keys()), key = "freq_q3_month")
             with CTX:
-                time_q3_plot = Figure(rows=1, cols=3). \
-                    new_chart(row=0, col=0). \
-                    plot_xy(series_name="2014",
-                            t=st.session_state.hourly_ride_freq_avg.where(["year == 2014", "month == (int)MONTH_STR_TO_INT[st.session_state.freq_q3_month]"]),
-                            x="timestamp",
-                            y="standardized_trip_count_avg"). \
-                    new_chart(row=0, col=1). \
-                    plot_xy(series_name="2015",
-                            t=st.session_state.hourly_ride_freq_avg.where(["year == 2015", "month == (int)MONTH_STR_TO_INT[st.session_state.freq_q3_month]"]),
-                            x="timestamp",
-                            y="standardized_trip_count_avg"). \
-                    new_chart(row=0, col=2). \
-                    plot_xy(series_name="2016",
-                            t=st.session_state.hourly_ride_freq_avg.where(["year == 2016", "month == (int)MONTH_STR_TO_INT[st.session_state.freq_q3_month]"]),
-                            x="timestamp",
-                            y="standardized_trip_count_avg"). \
-                    show()
-            display_dh(time_q3_plot)
+                display_dh(st.session_state.figure_lease.hold("time_q3_plot", time_q3_plot(
+                    tables["hourly_ride_freq_avg_by_month"], tables["hourly_ride_freq_avg"],
+                    MONTH_STR_TO_INT[st.session_state.freq_q3_month])))
 
         with st.expander("Which months have the highest ride counts? Which have the lowest?"):
             st.write("This plot shows the ride count by month for a given year. If all years are selected, only complete \
                      years will be included in the plot.")
             with CTX:
-                time_q4_plot = Figure() \
-                    .plot_cat(series_name="2013",
-                              t=st.session_state.daily_ride_freq.where("year == 2013").agg_by(agg.sum_("trip_count"), by="month"),
-                              category="month", y="trip_count") \
-                    .plot_cat(series_name="2014",
-                              t=st.session_state.daily_ride_freq.where("year == 2014").agg_by(agg.sum_("trip_count"), by="month"),
-                              category="month", y="trip_count") \
-                    .plot_cat(series_name="2015",
-                              t=st.session_state.daily_ride_freq.where("year == 2015").agg_by(agg.sum_("trip_count"), by="month"),
-                              category="month", y="trip_count") \
-                    .plot_cat(series_name="2016",
-                              t=st.session_state.daily_ride_freq.where("year == 2016").agg_by(agg.sum_("trip_count"), by="month"),
-                              category="month", y="trip_count") \
-                    .plot_cat(series_name="2017",
-                              t=st.session_state.daily_ride_freq.where("year == 2017").agg_by(agg.sum_("trip_count"), by="month"),
-                              category="month", y="trip_count") \
-                    .show()
-            display_dh(time_q4_plot)
+                display_dh(st.session_state.figure_lease.hold("time_q4_plot", time_q4_plot(tables["daily_ride_freq"])))
 
         with st.expander("How does subscription status affect the overall distribution of ride duration?"):
             st.write("This plot shows the distribution of ride duration for annual subscribers and everyone else. \
                      Interestingly, annual subscribers tend to take shorter trips.")
             with CTX:
-                time_q5_plot = Figure(rows=2, cols=1). \
-                    new_chart(row=0, col=0). \
-                    plot_xy_hist(series_name="Annual subscribers",
-                                 t=st.session_state.trips.where("subscriber_type == `Annual Membership`"),
-                                 x="duration_minutes",
-                                 nbins=50,
-                                 xmin=0.0,
-                                 xmax=100.0). \
-                    new_chart(row=1, col=0). \
-                    plot_xy_hist(series_name="Non-annual subscribers",
-                                 t=st.session_state.trips.where("subscriber_type != `Annual Membership`"),
-                                 x="duration_minutes",
-                                 nbins=50,
-                                 xmin=0.0,
-                                 xmax=100.0). \
-                    show()
-            display_dh(time_q5_plot)
+                display_dh(st.session_state.figure_lease.hold("time_q5_plot", time_q5_plot(tables["trips"])))
 
         with st.expander("What percentage of trips over 500 minutes are taken by different types of subscribers?"):
             st.write("This plot shows the percentage of trips over 500 minutes taken by each subscription type. The \
                      majority of long trips are taken by walk-up customers.")
             with CTX:
-                time_q6_plot = Figure(). \
-                    plot_pie(series_name="Long Rides by Subscription Type",
-                             t=st.session_state.trips.where("duration_minutes > 500").count_by("count", by="subscriber_type"),
-                             category="subscriber_type",
-                             y="count"). \
-                    show()
-            display_dh(time_q6_plot)
+                display_dh(st.session_state.figure_lease.hold("time_q6_plot", time_q6_plot(tables["trips"])))
 
         with st.expander("Do users tend to take longer rides on the weekends?"):
             st.write("This plot shows the average and median number of rides taken each day of the week, aggregated \
                      over the entire dataset. ")
-            day_of_week_name_array = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-
             with CTX:
-                time_q7_table = st.session_state.trips. \
-                    update(["day_of_week = dayOfWeek(start_time, 'CT')", ]). \
-                    agg_by([agg.avg("duration_avg = duration_minutes"),
-                            agg.median("duration_med = duration_minutes")], by="day_of_week"). \
-                    sort("day_of_week"). \
-                    update("day_of_week_name = (String)day_of_week_name_array[i]")
-
-                time_q7_plot = Figure(). \
-                    plot_cat(series_name="Average ride duration", t=time_q7_table, category="day_of_week_name",
-                             y="duration_avg"). \
-                    plot_cat(series_name="Median ride duration", t=time_q7_table, category="day_of_week_name",
-                             y="duration_med"). \
-                    show()
-            display_dh(time_q7_plot)
+                display_dh(st.session_state.figure_lease.hold("time_q7_plot", time_q7_plot(tables["trips"])))
 
         with st.expander("What is the overall intraday trend of ride duration for each day of the week?"):
             st.write("This plot shows the median minutely ride duration within each day, aggregated over the entire \
                      dataset.")
             st.selectbox("Select a day.", (WEEKDAY_STR_TO_INT.keys()), key = "time_q8_day")
-
             with CTX:
-                time_q8_table = st.session_state.trips. \
-                    update(["day_of_week = dayOfWeek(start_time, 'CT')",
-                            "minute_of_day = minuteOfDay(start_time, 'CT')"]). \
-                    agg_by(agg.median("duration_minutes"), by=["minute_of_day", "day_of_week"]). \
-                    sort("minute_of_day")
-
-                time_q8_plot = Figure(). \
-                    plot_xy(series_name="Median intraday ride duration",
-                            t=time_q8_table.where("day_of_week == (int)WEEKDAY_STR_TO_INT[st.session_state.time_q8_day]"),
-                            x="minute_of_day",
-                            y="duration_minutes"). \
-                    show()
-            display_dh(time_q8_plot)
+                q8_table = st.session_state.figure_lease.hold("time_q8_table", time_q8_table(tables["trips"]))
+                display_dh(st.session_state.figure_lease.hold("time_q8_plot", time_q8_plot(
+                    q8_table, WEEKDAY_STR_TO_INT[st.session_state.time_q8_day])))
+
+@live_cache
+def station_map_table(stations, station_trip_counts, station_types, direction, year, month):
+    table = stations.update("color = status == `active` ? `#1EB025` : status == `closed` ? `#DF0B0B` : status == `moved` ? `#CDC70E` : `#1859EE`")
+    if len(station_types) != 4:
+        table = table.where_one_of(["status == `" + station_type + "`" for station_type in station_types])
+    if direction is None:
+        return table
+
+    # a lookup into the station popularity cube, where a null year or month stands for all of them
+    counts = station_trip_counts.where(["direction == `" + direction + "`",
+                                        "isNull(year)" if year is None else "year == " + str(year),
+                                        "isNull(month)" if month is None else "month == " + str(month)])
+    return table.join(counts, on = "station_id", joins = "count = trip_count")
 
 with space_tab:
     space_c1, space_c2 = st.columns((0.3, 0.7))
-    with CTX:
-        stations_color = st.session_state.stations.update("color = status == `active` ? `#1EB025` : status == `closed` ? `#DF0B0B` : status == `moved` ? `#CDC70E` : `#1859EE`")
 
     with space_c1:
         st.multiselect("Select a station type.", ("active", "closed", "moved", "ACL only"),
@@ -341,31 +408,20 @@ with space_tab:
         st.selectbox("Select a month.", selectable_months, key = "space_month")
 
         with CTX:
-            if len(st.session_state.space_type) == 4:
-                space_table = stations_color
-            else:
-                space_table = stations_color.where_one_of(["status == `" + station_type + "`" for station_type in st.session_state.space_type])
-            if st.session_state.space_size != "None":
-                filtered_trips = st.session_state.trips
-                filter_query = []
-                if st.session_state.space_year != "All":
-                    filter_query.append("year == " + str(st.session_state.space_year))
-                if st.session_state.space_month != "All":
-                    filter_query.append("month == " + str(MONTH_STR_TO_INT[st.session_state.space_month]))
-                if filter_query:
-                    filtered_trips = filtered_trips.\
-                        update(["year = year(start_time, 'CT')", "month = monthOfYear(start_time, 'CT')"]).\
-                        where(filter_query)
-                if st.session_state.space_size == "Starting point popularity":
-                    space_table = space_table.join(filtered_trips.count_by("count", by = "start_station_id"), on = "station_id = start_station_id")
-                else:
-                    space_table = space_table.join(filtered_trips.count_by("count", by="end_station_id"), on="station_id = end_station_id")
+            space_direction = {"None": None, "Starting point popularity": "start", "End point popularity": "end"}[st.session_state.space_size]
+            space_table = station_map_table(tables["stations"], tables["station_trip_counts"], sorted(st.session_state.space_type),
+                                            space_direction,
+                                            None if st.session_state.space_year == "All" else st.session_state.space_year,
+                                            None if st.session_state.space_month == "All" else MONTH_STR_TO_INT[st.session_state.space_month])
+            st.session_state.figure_lease.hold("space_table", space_table)
 
     with space_c2:
         with CTX:
-            space_table_df = dhpd.to_pandas(space_table)
+            # the points are read as typed arrays straight from the table; st.map only takes a DataFrame and
+            # redraws every point on each rerun, so the arrays are handed over as a frame of about 70 rows
             if st.session_state.space_size != "None":
-                space_table_df["count"] = 2000 * space_table_df["count"] / space_table_df["count"].sum()
-                st.map(space_table_df, size="count", color="color", use_container_width=True)
+                space_points = PointPayload.from_table(space_table, "station_id", "latitude", "longitude", "color",
+                                                       size_col="count", size_total=2000)
             else:
-                st.map(space_table_df, size=25, color="color", use_container_width=True)
\ No newline at end of file
+                space_points = PointPayload.from_table(space_table, "station_id", "latitude", "longitude", "color")
+        st.map(space_points.to_frame(), size="size", color="color", use_container_width=True)
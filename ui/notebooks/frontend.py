@@ -4,14 +4,70 @@ from deephaven.plot.figure import Figure
 import deephaven.agg as agg
 import deephaven.updateby as uby
 
+from deephaven.liveness_scope import liveness_scope
+from deephaven.table import Table
+
+from collections import OrderedDict
+
+from shared.query import QueryEngine, QueryError
+from shared.table_cache import TABLE_CACHE
+
+def use_lru_memo(build, key, capacity=4, release=None):
+    # values built for the last few keys are kept with the tables behind them, so going back to an earlier
+    # selection reuses its value instead of building a new one; release(value) is called as one is dropped
+    cache = ui.use_ref(None)
+    if cache.current is None:
+        cache.current = OrderedDict()
+    entries = cache.current
+
+    def drop(entry):
+        value, scope = entry
+        if release is not None:
+            release(value)
+        scope.release()
+
+    if key not in entries:
+        scope = liveness_scope()
+        with scope.open():
+            entries[key] = (build(), scope)
+        while len(entries) > capacity:
+            drop(entries.popitem(last=False)[1])
+    entries.move_to_end(key)
+
+    def clear():
+        while entries:
+            drop(entries.popitem()[1])
+
+    ui.use_effect(lambda: clear, [])
+    return entries[key][0]
+
+def month_table(by_month, table, year, month):
+    # the data only covers some (year, month) pairs, and in streaming mode a month has no constituent until its
+    # first trip ticks in, so fall back to filtering table, which is empty until then instead of None
+    constituent = by_month.get_constituent([year, month])
+    return constituent if constituent is not None else table.where([f"year == {year}", f"month == {month}"])
+
 ######################
 #### RAW DATA TAB ####
 ######################
 
+# user queries are chains of whitelisted table operations on the backend tables, with formulas held to methods
+# on columns by shared.query.check_formulas; results are shared by all sessions
+QUERY_ENGINE = QueryEngine({name: value for name, value in globals().items() if isinstance(value, Table)})
+
+def run_query(query):
+    try:
+        return QUERY_ENGINE.run(query), None
+    except QueryError as e:
+        return None, str(e)
+    except Exception as e:
+        return None, f"query failed: {e}"
+
 @ui.component
 def create_query():
     query, set_query = ui.use_state("trips.update(\"month = monthOfYear(start_time, 'CT')\").where(\"month == 3\")")
-    table = ui.use_memo(lambda : eval(query), [query])
+    table, error = ui.use_memo(lambda: run_query(query), [query])
+    ui.use_effect(lambda: lambda: QUERY_ENGINE.release(table), [table])
     return ui.flex(
         "Input your own Deephaven query here!",
         ui.form(
@@ -19,7 +75,7 @@ def create_query():
             ui.button("Submit", type="submit"),
             on_submit=lambda data: set_query(data["query"])
         ),
-        table,
+        table if error is None else ui.text(error),
         direction="column",
         flex_grow=1
     )
@@ -84,16 +140,16 @@ def daily_ride_count_tab():
 def hourly_ride_count_tab():
     valid_years = [2013, 2014, 2015, 2016, 2017]
     selected_year, set_selected_year = ui.use_state(2014)
+    hourly_table = ui.use_memo(
+        lambda: month_table(hourly_ride_freq_avg_by_month, hourly_ride_freq_avg, selected_year, 3), [selected_year])
 
     plot = Figure(). \
         plot_xy(series_name="Hourly ride count",
-                t=hourly_ride_freq_avg.where(["year == (int)selected_year",
-                                                "month == 3"]),
+                t=hourly_table,
                 x="timestamp",
                 y="trip_count"). \
         plot_xy(series_name="24-hour rolling average",
-                t=hourly_ride_freq_avg.where(["year == (int)selected_year",
-                                                "month == 3"]),
+                t=hourly_table,
                 x="timestamp",
                 y="trip_count_avg"). \
         show()
@@ -128,7 +184,7 @@ def daily_ride_duration_tab():
     elif selected_stat == "Median":
         daily_title, daily_stat_column, daily_rolling_stat_column = ("Daily median ride duration in minutes", "duration_med", "duration_avg_med")
 
-    plot = Figure().\
+    plot = use_lru_memo(lambda: Figure().\
         plot_xy(series_name=daily_title,
                 t=daily_ride_dur_avg,
                 x="timestamp",
@@ -137,7 +193,7 @@ def daily_ride_duration_tab():
                 t=daily_ride_dur_avg,
                 x="timestamp",
                 y=daily_rolling_stat_column).\
-        show()
+        show(), selected_stat)
     
     return ui.flex(
         ui.text("Select a date range."),
@@ -164,16 +220,23 @@ def hourly_ride_duration_tab():
     elif selected_stat == "Median":
         hourly_title, hourly_stat_column, hourly_rolling_stat_column = ("Hourly median ride duration in minutes", "duration_med", "duration_avg_med")
 
-    plot = Figure().\
-        plot_xy(series_name=hourly_title,
-                t=hourly_ride_dur_avg.where(f"year == {selected_year}"),
-                x="timestamp",
-                y=hourly_stat_column).\
-        plot_xy(series_name="30-day rolling average",
-                t=hourly_ride_dur_avg.where(f"year == {selected_year}"),
-                x="timestamp",
-                y=hourly_rolling_stat_column).\
-        show()
+    def hourly_plot():
+        year_ride_dur_avg = TABLE_CACHE.where(hourly_ride_dur_avg, "year == {year}", year=selected_year)
+        plot = Figure().\
+            plot_xy(series_name=hourly_title,
+                    t=year_ride_dur_avg,
+                    x="timestamp",
+                    y=hourly_stat_column).\
+            plot_xy(series_name="30-day rolling average",
+                    t=year_ride_dur_avg,
+                    x="timestamp",
+                    y=hourly_rolling_stat_column).\
+            show()
+        return plot, year_ride_dur_avg
+
+    # the filtered table stays acquired from the shared cache for as long as its figure is kept
+    plot, _ = use_lru_memo(hourly_plot, (selected_year, selected_stat),
+                           release=lambda value: TABLE_CACHE.release(value[1]))
 
     return ui.flex(
         ui.flex(
@@ -250,17 +313,17 @@ def q3():
     plot = Figure(rows=1, cols=3). \
         new_chart(row=0, col=0). \
         plot_xy(series_name="2014",
-                t=hourly_ride_freq_avg.where(["year == 2014", "month == 3"]),
+                t=month_table(hourly_ride_freq_avg_by_month, hourly_ride_freq_avg, 2014, 3),
                 x="timestamp",
                 y="standardized_trip_count_avg"). \
         new_chart(row=0, col=1). \
         plot_xy(series_name="2015",
-                t=hourly_ride_freq_avg.where(["year == 2015", "month == 3"]),
+                t=month_table(hourly_ride_freq_avg_by_month, hourly_ride_freq_avg, 2015, 3),
                 x="timestamp",
                 y="standardized_trip_count_avg"). \
         new_chart(row=0, col=2). \
         plot_xy(series_name="2016",
-                t=hourly_ride_freq_avg.where(["year == 2016", "month == 3"]),
+                t=month_table(hourly_ride_freq_avg_by_month, hourly_ride_freq_avg, 2016, 3),
                 x="timestamp",
                 y="standardized_trip_count_avg"). \
         show()
@@ -398,29 +461,54 @@ def q8():
         flex_grow=1
     )
 
+# panels and research questions are only mounted while they are selected, so the tables and figures of the
+# others are not built until they are opened, and are released along with their component when closed
+TIME_PANELS = {
+    "Daily ride count": daily_ride_count_tab,
+    "Hourly ride count": hourly_ride_count_tab,
+    "Daily ride duration": daily_ride_duration_tab,
+    "Hourly ride duration": hourly_ride_duration_tab,
+}
+
+RESEARCH_QUESTIONS = {
+    "How are subscription type and ride count related?": q1,
+    "How does overall ride count trend compare from year to year?": q2,
+    "Do the same months exhibit similar ride count trends from year to year?": q3,
+    "Which months have the highest ride counts? Which have the lowest?": q4,
+    "How does subscription status affect the overall distribution of ride duration?": q5,
+    "What percentage of trips over 500 minutes are taken by different types of subscribers?": q6,
+    "Do users tend to take longer rides on the weekends?": q7,
+    "What is the overall intraday trend of ride duration for each day of the week?": q8,
+}
+
 @ui.component
 def through_time_tab():
+    selected_panel, set_selected_panel = ui.use_state("Daily ride count")
+    selected_question, set_selected_question = ui.use_state(next(iter(RESEARCH_QUESTIONS)))
+
     return ui.flex(
         ui.flex(
             ui.tabs(
                 ui.tab_list(
-                    ui.item("Daily ride count", key="Daily ride count"),
-                    ui.item("Hourly ride count", key="Hourly ride count"),
-                    ui.item("Daily ride duration", key="Daily ride duration"),
-                    ui.item("Hourly ride duration", key="Hourly ride duration")
+                    *[ui.item(name, key=name) for name in TIME_PANELS]
                 ),
                 ui.tab_panels(
-                    ui.item(daily_ride_count_tab(), key="Daily ride count", flex_grow=1),
-                    ui.item(hourly_ride_count_tab(), key="Hourly ride count"),
-                    ui.item(daily_ride_duration_tab(), key="Daily ride duration"),
-                    ui.item(hourly_ride_duration_tab(), key="Hourly ride duration")
-                )
+                    *[ui.item(panel() if name == selected_panel else ui.flex(), key=name, flex_grow=1)
+                      for name, panel in TIME_PANELS.items()]
+                ),
+                selected_key=selected_panel,
+                on_selection_change=set_selected_panel
             ),
             flex_grow=1
         ),
         ui.flex(
             ui.text("Some interesting research questions..."),
-            q1(),
+            ui.picker(
+                *[ui.item(question, key=question) for question in RESEARCH_QUESTIONS],
+                selected_key=selected_question,
+                on_selection_change=set_selected_question
+            ),
+            RESEARCH_QUESTIONS[selected_question](),
             direction="column",
             flex_grow=1
         ),